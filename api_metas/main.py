@@ -1,13 +1,117 @@
 # api_metas/main.py
+import argparse
+import io
 import os
-from fastapi import FastAPI, HTTPException, Path
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+import psycopg2
+from fastapi import FastAPI, Header, HTTPException, Path, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from typing import List
-import psycopg2
+from typing import List, Optional
+from common.admission import BULK, AdmissionController, AdmissionMiddleware, default_priority, query_flag
+from common.aio import AsyncDatabase
+from common.batch import in_request_order, parse_ids
+from common.cache import MISSING, TTLCache, backend_from_env
+from common.db import ConnectionPool
+from common.encoding import negotiate
+from common.etag import check_not_modified, make_etag
+from common.metrics import TimedJSONResponse, TimedRowsResponse, install_metrics
+from common.migrate import migrate, run_plan_checks
+from common.prepared import prepared
+from common.replica import ReadYourWritesMiddleware, ReplicaSet, sticky_request
+from common.singleflight import SingleFlight
+from common.sql import partial_update
+from common.tracing import install_observability
+
+app = FastAPI(title="API Metas", default_response_class=TimedJSONResponse)
+
+# Bodies of at least GZIP_MIN_SIZE bytes are gzipped for clients that accept it.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+# Database connection for ML METAS
+DB_HOST = os.getenv("DATABASE_HOST", "172.31.82.228")
+DB_PORT = os.getenv("DATABASE_PORT", "5434")
+DB_NAME = os.getenv("DATABASE_NAME", "ml_metas")
+DB_USER = os.getenv("DATABASE_USER", "postgres")
+DB_PASSWORD = os.getenv("DATABASE_PASSWORD", "postgres")
+
+db = ConnectionPool(
+    host=DB_HOST, port=DB_PORT,
+    dbname=DB_NAME, user=DB_USER,
+    password=DB_PASSWORD
+)
+# Opt-in asyncpg path (DATABASE_ASYNC=1) for the hottest read handlers.
+adb = AsyncDatabase(
+    db, host=DB_HOST, port=DB_PORT,
+    dbname=DB_NAME, user=DB_USER,
+    password=DB_PASSWORD
+)
+# GET handlers read from DATABASE_REPLICAS when configured, with lag-aware
+# fallback to the primary; writes always use db (see common/replica.py).
+replicas = ReplicaSet(db, adb, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+app.add_middleware(ReadYourWritesMiddleware)
+# Campaign progress is computed from purchases in core_transactions, so the
+# service keeps a second, lazily opened pool for that database.
+TRANSACTIONS_DB_HOST = os.getenv("TRANSACTIONS_DATABASE_HOST", DB_HOST)
+TRANSACTIONS_DB_PORT = os.getenv("TRANSACTIONS_DATABASE_PORT", "5433")
+TRANSACTIONS_DB_NAME = os.getenv("TRANSACTIONS_DATABASE_NAME", "core_transactions")
+TRANSACTIONS_DB_USER = os.getenv("TRANSACTIONS_DATABASE_USER", DB_USER)
+TRANSACTIONS_DB_PASSWORD = os.getenv("TRANSACTIONS_DATABASE_PASSWORD", DB_PASSWORD)
+PROGRESS_CHUNK_USERS = int(os.getenv("PROGRESS_CHUNK_USERS", "10000"))
+
+transactions_db = ConnectionPool(
+    minconn=0, host=TRANSACTIONS_DB_HOST, port=TRANSACTIONS_DB_PORT,
+    dbname=TRANSACTIONS_DB_NAME, user=TRANSACTIONS_DB_USER,
+    password=TRANSACTIONS_DB_PASSWORD
+)
+
+@app.on_event("startup")
+def open_pool():
+    db.open()
+    replicas.open()
+    transactions_db.open()
+
+@app.on_event("startup")
+async def open_async_pool():
+    await adb.open()
+    await replicas.open_async()
+
+@app.on_event("shutdown")
+async def close_async_pool():
+    await replicas.close_async()
+    await adb.close()
+
+@app.on_event("shutdown")
+def close_pool():
+    replicas.close()
+    db.close()
+    transactions_db.close()
 
-app = FastAPI(title="API Metas")
+@app.get("/stats/pool")
+def get_pool_stats():
+    return {**db.stats(), "async": adb.stats(), "replicas": replicas.stats()}
 
+# Concurrent identical reads share one in-flight query (see @flight.coalesce),
+# except for requests pinned to the primary, which must not be served a
+# replica read started by another client.
+flight = SingleFlight(bypass=sticky_request)
+
+# Requests beyond an adaptive concurrency limit queue by priority and are
+# shed early with 429/503 and Retry-After (see common/admission.py). Added
+# before the metrics middleware so that rejections are still counted.
+admission = AdmissionController()
+
+def request_priority(scope):
+    # Forced progress recomputes are the most expensive reads and are shed first.
+    if query_flag(scope, "refresh"):
+        return BULK
+    return default_priority(scope)
+
+app.add_middleware(AdmissionMiddleware, controller=admission, classify=request_priority)
+# Starlette runs the last middleware added first: CORS goes on after
+# admission so that 429/503 rejections carry CORS headers too.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # You can also use ["*"] to allow all origins, but be cautious in production.
@@ -16,23 +120,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database connection for ML METAS
-DB_HOST = os.getenv("DATABASE_HOST", "172.31.82.228")
-DB_PORT = os.getenv("DATABASE_PORT", "5434")
-DB_NAME = os.getenv("DATABASE_NAME", "ml_metas")
-DB_USER = os.getenv("DATABASE_USER", "postgres")
-DB_PASSWORD = os.getenv("DATABASE_PASSWORD", "postgres")
+# Prometheus-format /metrics: per-route latency, DB and serialization time.
+metrics = install_metrics(app)
+metrics.add_collector("db_pool", db.stats)
+metrics.add_collector("db_async_pool", adb.stats)
+metrics.add_collector("db_replicas", replicas.stats)
+metrics.add_collector("transactions_db_pool", transactions_db.stats)
+metrics.add_collector("coalescing", flight.stats)
+metrics.add_collector("admission", admission.stats)
+install_observability(app, db, metrics)
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT,
-            dbname=DB_NAME, user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Database connection error")
+@app.get("/stats/coalescing")
+def get_coalescing_stats():
+    return flight.stats()
+
+@app.get("/stats/admission")
+def get_admission_stats():
+    return admission.stats()
 
 # ----- Models for Campaigns Management -----
 class Campaign(BaseModel):
@@ -50,103 +154,426 @@ class CampaignUpdate(BaseModel):
     start_date: str = None
     end_date: str = None
 
+# ---------- Campaign cache ----------
+# Campaigns change a few times a day, so reads are served from a TTL+LRU
+# cache. User assignments are cached as lists of campaign ids and resolved
+# through the per-campaign entries, which lets writes invalidate exactly the
+# campaign they touched. Entries are [xmin, campaign] pairs so that ETags can
+# be computed from the cache without asking the database. Requests pinned to
+# the primary after a write skip the cache, which a lagging replica may have
+# refilled with the old row, and refill it from the primary.
+CACHE_TTL = float(os.getenv("CAMPAIGN_CACHE_TTL", "300"))
+CACHE_MAXSIZE = int(os.getenv("CAMPAIGN_CACHE_MAXSIZE", "10000"))
+cache_backend = backend_from_env()
+campaign_cache = TTLCache("campaign", maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, backend=cache_backend)
+user_campaigns_cache = TTLCache("user_campaigns", maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, backend=cache_backend)
+
+metrics.add_collector("campaign_cache", campaign_cache.stats)
+metrics.add_collector("user_campaigns_cache", user_campaigns_cache.stats)
+
+@app.get("/stats/cache")
+def get_cache_stats():
+    return {
+        "campaign": campaign_cache.stats(),
+        "user_campaigns": user_campaigns_cache.stats(),
+        "progress": progress_cache.stats(),
+    }
+
+CAMPAIGN_COLUMNS = ("id", "name", "goal", "cashback_percentage", "start_date", "end_date")
+
+def campaign_row(camp):
+    return {
+        "id": camp[0],
+        "name": camp[1],
+        "goal": float(camp[2]),
+        "cashback_percentage": float(camp[3]),
+        "start_date": str(camp[4]),
+        "end_date": str(camp[5])
+    }
+
+def cache_campaign(camp):
+    # camp: a campaigns row followed by its xmin
+    entry = [camp[6], campaign_row(camp)]
+    campaign_cache.set(camp[0], entry)
+    return entry
+
+def campaigns_etag(entries, *variant):
+    return make_etag(tuple((campaign["id"], version) for version, campaign in entries), *variant)
+
+def campaigns_response(camps, accept, etag):
+    return TimedRowsResponse(
+        CAMPAIGN_COLUMNS, [tuple(campaign[column] for column in CAMPAIGN_COLUMNS) for campaign in camps], accept,
+        headers={"ETag": etag}
+    )
+
 # ---------- Endpoints for Campaigns Management ----------
 
+CAMPAIGN_SQL = prepared(
+    "SELECT id, name, goal, cashback_percentage, start_date, end_date, xmin::text FROM campaigns WHERE id = %s"
+)
+CAMPAIGNS_SQL = prepared(
+    "SELECT id, name, goal, cashback_percentage, start_date, end_date, xmin::text FROM campaigns WHERE id = ANY(%s)"
+)
+
 @app.get("/campaigns/{campaign_id}")
-def get_campaign(campaign_id: int = Path(..., title="Campaign ID")):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id, name, goal, cashback_percentage, start_date, end_date FROM campaigns WHERE id = %s", (campaign_id,))
-        camp = cur.fetchone()
-        if not camp:
-            raise HTTPException(status_code=404, detail="Campaign not found")
-        return {
-            "id": camp[0],
-            "name": camp[1],
-            "goal": float(camp[2]),
-            "cashback_percentage": float(camp[3]),
-            "start_date": str(camp[4]),
-            "end_date": str(camp[5])
-        }
-    finally:
-        cur.close()
-        conn.close()
+@flight.coalesce
+def get_campaign(
+    campaign_id: int = Path(..., title="Campaign ID"),
+    if_none_match: Optional[str] = Header(None),
+):
+    entry = MISSING if sticky_request() else campaign_cache.get(campaign_id)
+    if entry is MISSING:
+        with replicas.connection() as conn, conn.cursor() as cur:
+            cur.execute(CAMPAIGN_SQL, (campaign_id,))
+            camp = cur.fetchone()
+            if not camp:
+                raise HTTPException(status_code=404, detail="Campaign not found")
+            entry = cache_campaign(camp)
+    version, campaign = entry
+    etag = make_etag(version, "campaign")
+    check_not_modified(if_none_match, etag)
+    return TimedJSONResponse(campaign, headers={"ETag": etag})
+
+def load_campaigns(campaign_ids):
+    # Cache entries by id, reading the misses in one query; unknown ids are left out.
+    found = {} if sticky_request() else campaign_cache.get_many(campaign_ids)
+    missing = [campaign_id for campaign_id in campaign_ids if campaign_id not in found]
+    if missing:
+        with replicas.connection() as conn, conn.cursor() as cur:
+            cur.execute(CAMPAIGNS_SQL, (missing,))
+            for camp in cur.fetchall():
+                found[camp[0]] = cache_campaign(camp)
+    return found
+
+@app.get("/campaigns")
+def get_campaigns(
+    ids: str = Query(..., description="Comma-separated campaign IDs"),
+    if_none_match: Optional[str] = Header(None),
+):
+    campaign_ids = parse_ids(ids)
+    # No version query: the cache entries carry their xmin, so the ETag of a
+    # cached list costs no database round trip.
+    found = load_campaigns(set(campaign_ids))
+    etag = campaigns_etag(sorted(found.values(), key=lambda entry: entry[1]["id"]), "campaigns", tuple(campaign_ids))
+    check_not_modified(if_none_match, etag)
+    found = {campaign_id: campaign for campaign_id, (_, campaign) in found.items()}
+    return TimedJSONResponse(in_request_order(campaign_ids, found), headers={"ETag": etag})
 
 @app.get("/users/{user_id}/campaigns")
-def get_user_campaigns(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # Retrieve campaigns assigned to a user via the user_campaigns join table.
-        query = """
-            SELECT c.id, c.name, c.goal, c.cashback_percentage, c.start_date, c.end_date
-            FROM campaigns c
-            JOIN user_campaigns uc ON c.id = uc.campaign_id
-            WHERE uc.user_id = %s
-        """
-        cur.execute(query, (user_id,))
-        camps = cur.fetchall()
-        return [
-            {
-                "id": row[0],
-                "name": row[1],
-                "goal": float(row[2]),
-                "cashback_percentage": float(row[3]),
-                "start_date": str(row[4]),
-                "end_date": str(row[5])
-            } for row in camps
-        ]
-    finally:
-        cur.close()
-        conn.close()
+@flight.coalesce
+async def get_user_campaigns(
+    user_id: int, accept: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)
+):
+    # Cache calls go through call(): a shared backend must not block the event loop.
+    campaign_ids = MISSING if sticky_request() else await user_campaigns_cache.call(user_campaigns_cache.get, user_id)
+    entries = None
+    if campaign_ids is not MISSING:
+        cached = await campaign_cache.call(campaign_cache.get_many, campaign_ids)
+        if len(cached) == len(campaign_ids):
+            entries = [cached[campaign_id] for campaign_id in campaign_ids]
+    if entries is None:
+        entries = await load_user_campaigns(user_id)
+    etag = campaigns_etag(entries, "user_campaigns", negotiate(accept))
+    check_not_modified(if_none_match, etag, vary="Accept")
+    return campaigns_response([campaign for _, campaign in entries], accept, etag)
+
+# Campaigns assigned to a user via the user_campaigns join table.
+USER_CAMPAIGNS_SQL = prepared("""
+    SELECT c.id, c.name, c.goal, c.cashback_percentage, c.start_date, c.end_date, c.xmin::text
+    FROM campaigns c
+    JOIN user_campaigns uc ON c.id = uc.campaign_id
+    WHERE uc.user_id = %s
+    ORDER BY c.id
+""")
+
+def cache_user_campaigns(user_id, rows):
+    entries = [cache_campaign(row) for row in rows]
+    user_campaigns_cache.set(user_id, [campaign["id"] for _, campaign in entries])
+    return entries
+
+async def load_user_campaigns(user_id):
+    rows = await replicas.fetch_all(USER_CAMPAIGNS_SQL, (user_id,))
+    return await user_campaigns_cache.call(cache_user_campaigns, user_id, rows)
 
 @app.post("/campaigns", status_code=201)
 def create_campaign(campaign: Campaign):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO campaigns (name, goal, cashback_percentage, start_date, end_date) VALUES (%s, %s, %s, %s, %s) RETURNING id",
             (campaign.name, campaign.goal, campaign.cashback_percentage, campaign.start_date, campaign.end_date)
         )
         camp_id = cur.fetchone()[0]
         conn.commit()
-        return {"id": camp_id}
-    finally:
-        cur.close()
-        conn.close()
+    campaign_cache.invalidate(camp_id)
+    return {"id": camp_id}
 
 @app.put("/campaigns/{campaign_id}")
 def update_campaign(campaign_id: int, camp_update: CampaignUpdate):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        if camp_update.name:
-            cur.execute("UPDATE campaigns SET name = %s WHERE id = %s", (camp_update.name, campaign_id))
-        if camp_update.goal is not None:
-            cur.execute("UPDATE campaigns SET goal = %s WHERE id = %s", (camp_update.goal, campaign_id))
-        if camp_update.cashback_percentage is not None:
-            cur.execute("UPDATE campaigns SET cashback_percentage = %s WHERE id = %s", (camp_update.cashback_percentage, campaign_id))
-        if camp_update.start_date:
-            cur.execute("UPDATE campaigns SET start_date = %s WHERE id = %s", (camp_update.start_date, campaign_id))
-        if camp_update.end_date:
-            cur.execute("UPDATE campaigns SET end_date = %s WHERE id = %s", (camp_update.end_date, campaign_id))
+    with db.connection() as conn, conn.cursor() as cur:
+        camp = partial_update(
+            cur, "campaigns", camp_update, {"id": campaign_id},
+            ("id", "name", "goal", "cashback_percentage", "start_date", "end_date")
+        )
+        if not camp:
+            raise HTTPException(status_code=404, detail="Campaign not found")
         conn.commit()
-        return {"message": "Campaign updated successfully"}
-    finally:
-        cur.close()
-        conn.close()
+    campaign_cache.invalidate(campaign_id)
+    # A read served by a lagging replica may have cached the old row again.
+    replicas.after_lag(campaign_cache.invalidate, campaign_id)
+    return campaign_row(camp)
 
 @app.delete("/campaigns/{campaign_id}")
 def delete_campaign(campaign_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         # Logical deletion: update status to 'inactive'. Assuming campaigns table has a "status" column.
         cur.execute("UPDATE campaigns SET status = 'inactive' WHERE id = %s", (campaign_id,))
         conn.commit()
-        return {"message": "Campaign logically deleted"}
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    campaign_cache.invalidate(campaign_id)
+    # A read served by a lagging replica may have cached the old row again.
+    replicas.after_lag(campaign_cache.invalidate, campaign_id)
+    return {"message": "Campaign logically deleted"}
+
+# ---------- Campaign progress ----------
+
+# Spend toward a goal is the sum of a user's live Mastercard and PayPal
+# purchases whose created_at date falls inside the campaign window; internal
+# transfers do not count. Cashback (spend * cashback_percentage) is earned
+# once the goal is reached. Results are stored in campaign_progress by
+# `python main.py recompute-progress` and read back by the endpoint below.
+# Users the job has not stored yet are computed in memory on read, and the
+# result is cached for PROGRESS_CACHE_TTL seconds: reads never write.
+
+# Dates travel as days since 1970-01-01 and money as integer cents.
+EPOCH = date(1970, 1, 1)
+ASSIGNMENTS_SQL = """
+    SELECT uc.user_id, uc.campaign_id, (c.goal * 100)::bigint, c.cashback_percentage::float8,
+           c.start_date - DATE '1970-01-01', c.end_date - DATE '1970-01-01'
+    FROM user_campaigns uc
+    JOIN campaigns c ON c.id = uc.campaign_id
+    WHERE uc.user_id > %s AND uc.user_id <= %s AND c.status = 'active'
+"""
+# Summed per user and day in the database, so only one row per active day
+# crosses the wire.
+DAILY_SPEND_SQL = """
+    SELECT user_id, created_at::date - DATE '1970-01-01' AS day, (sum(amount) * 100)::bigint FROM (
+        SELECT user_id, created_at, amount FROM transactions_mastercard
+        WHERE user_id > %(after)s AND user_id <= %(last)s AND status IS DISTINCT FROM 'deleted'
+          AND created_at >= %(since)s AND created_at < %(until)s
+        UNION ALL
+        SELECT user_id, created_at, amount FROM transactions_paypal
+        WHERE user_id > %(after)s AND user_id <= %(last)s AND status IS DISTINCT FROM 'deleted'
+          AND created_at >= %(since)s AND created_at < %(until)s
+    ) t
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+"""
+USER_PROGRESS_SQL = prepared("""
+    SELECT p.campaign_id, c.name, c.goal, c.start_date, c.end_date,
+           p.spent, p.progress, p.cashback, p.completed, p.computed_at
+    FROM campaign_progress p
+    JOIN campaigns c ON c.id = p.campaign_id
+    WHERE p.user_id = %s
+    ORDER BY p.campaign_id
+""")
+DAY_BITS = 20  # days since 1970 stay far below 2**20
+# Serializes writers of campaign_progress, whose ranges may overlap.
+PROGRESS_LOCK = 7268355
+PROGRESS_CACHE_TTL = float(os.getenv("PROGRESS_CACHE_TTL", "60"))
+progress_cache = TTLCache("progress", maxsize=CACHE_MAXSIZE, ttl=PROGRESS_CACHE_TTL, backend=cache_backend)
+metrics.add_collector("progress_cache", progress_cache.stats)
+
+def fetch_columns(cur, query, params, dtype):
+    cur.execute(query, params)
+    return np.array(cur.fetchall(), dtype=dtype).reshape(-1, len(cur.description))
+
+def compute_progress(assignments, spend):
+    """Evaluate every (user, campaign) assignment in one vectorized pass.
+
+    ``assignments`` rows are ASSIGNMENTS_SQL rows and ``spend`` rows are
+    DAILY_SPEND_SQL rows, sorted by user and day. Packing (user, day) into a
+    single int64 key turns each campaign window into two ``searchsorted``
+    lookups over a prefix sum of the daily spend.
+
+    Returns one row per assignment: user_id, campaign_id, spent, progress,
+    cashback and completed (0 or 1), with money in currency units.
+    """
+    user = assignments[:, 0].astype(np.int64)
+    goal = assignments[:, 2]
+    percentage = assignments[:, 3]
+    start = assignments[:, 4].astype(np.int64)
+    end = assignments[:, 5].astype(np.int64)
+
+    keys = (spend[:, 0] << DAY_BITS) | spend[:, 1]
+    cumulative = np.concatenate(([0], np.cumsum(spend[:, 2])))
+    lo = np.searchsorted(keys, (user << DAY_BITS) | start, side="left")
+    hi = np.searchsorted(keys, (user << DAY_BITS) | end, side="right")
+    spent = (cumulative[hi] - cumulative[lo]).astype(np.float64)
+
+    progress = np.minimum(np.divide(spent, goal, out=np.ones_like(spent), where=goal > 0), 1.0)
+    completed = spent >= goal
+    cashback = np.where(completed, np.rint(spent * percentage / 100), 0)
+    return np.column_stack((user, assignments[:, 1], spent / 100, progress, cashback / 100, completed))
+
+def progress_rows(after, last):
+    # Progress of every active assignment of users in (after, last].
+    with db.connection() as conn, conn.cursor() as cur:
+        assignments = fetch_columns(cur, ASSIGNMENTS_SQL, (after, last), np.float64)
+    spend = np.empty((0, 3), dtype=np.int64)
+    if len(assignments):
+        window = {
+            "after": after, "last": last,
+            "since": EPOCH + timedelta(days=int(assignments[:, 4].min())),
+            "until": EPOCH + timedelta(days=int(assignments[:, 5].max()) + 1),
+        }
+        with transactions_db.connection() as conn, conn.cursor() as cur:
+            spend = fetch_columns(cur, DAILY_SPEND_SQL, window, np.int64)
+    return compute_progress(assignments, spend)
+
+def recompute_progress(after, last):
+    # Recomputes users in (after, last] and replaces their stored rows.
+    rows = progress_rows(after, last)
+    buffer = io.StringIO()
+    np.savetxt(buffer, rows, fmt="%d\t%d\t%.2f\t%.6f\t%.2f\t%d")
+    buffer.seek(0)
+    with db.connection() as conn, conn.cursor() as cur:
+        # Held until commit, so a concurrent run deletes only committed rows.
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (PROGRESS_LOCK,))
+        cur.execute("DELETE FROM campaign_progress WHERE user_id > %s AND user_id <= %s", (after, last))
+        cur.copy_expert(
+            "COPY campaign_progress (user_id, campaign_id, spent, progress, cashback, completed) FROM STDIN", buffer
+        )
+        conn.commit()
+    return len(rows)
+
+def recompute_all_progress(chunk_users=None):
+    # Walks user_campaigns in user_id order, chunk_users users at a time, so
+    # memory is bounded by the chunk rather than the user base.
+    chunk_users = chunk_users or PROGRESS_CHUNK_USERS
+    after, total = -1, 0
+    while True:
+        with db.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT max(user_id) FROM (SELECT DISTINCT user_id FROM user_campaigns "
+                "WHERE user_id > %s ORDER BY user_id LIMIT %s) t",
+                (after, chunk_users)
+            )
+            last = cur.fetchone()[0]
+        if last is None:
+            break
+        total += recompute_progress(after, last)
+        print("users up to %d: %d assignments" % (last, total))
+        after = last
+    # Users without assignments any more.
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (PROGRESS_LOCK,))
+        cur.execute("DELETE FROM campaign_progress WHERE user_id > %s", (after,))
+        conn.commit()
+    return total
+
+def progress_row(row):
+    return {
+        "campaign_id": row[0],
+        "name": row[1],
+        "goal": float(row[2]),
+        "start_date": str(row[3]),
+        "end_date": str(row[4]),
+        "spent": float(row[5]),
+        "progress": row[6],
+        "cashback": float(row[7]),
+        "completed": row[8],
+        "computed_at": row[9].isoformat()
+    }
+
+def load_progress(user_id):
+    with replicas.connection() as conn, conn.cursor() as cur:
+        cur.execute(USER_PROGRESS_SQL, (user_id,))
+        return [progress_row(row) for row in cur.fetchall()]
+
+def live_progress(user_id):
+    # Same shape as progress_row, computed now and not stored.
+    rows = progress_rows(user_id - 1, user_id)
+    campaigns = load_campaigns({int(row[1]) for row in rows})
+    computed_at = datetime.now(timezone.utc).isoformat()
+    progress = []
+    for _, campaign_id, spent, fraction, cashback, completed in sorted(rows.tolist(), key=lambda row: row[1]):
+        entry = campaigns.get(int(campaign_id))
+        if entry is None:
+            continue
+        campaign = entry[1]
+        progress.append({
+            "campaign_id": campaign["id"],
+            "name": campaign["name"],
+            "goal": campaign["goal"],
+            "start_date": campaign["start_date"],
+            "end_date": campaign["end_date"],
+            "spent": round(spent, 2),
+            "progress": round(fraction, 6),
+            "cashback": round(cashback, 2),
+            "completed": bool(completed),
+            "computed_at": computed_at
+        })
+    return progress
+
+@app.get("/users/{user_id}/campaigns/progress")
+@flight.coalesce
+def get_user_campaigns_progress(
+    user_id: int,
+    refresh: bool = Query(False, description="Compute from current transactions instead of the stored rows"),
+    if_none_match: Optional[str] = Header(None),
+):
+    progress = [] if refresh else load_progress(user_id)
+    if not progress:
+        # Not stored by the bulk job yet, or no assignments: computed here,
+        # and the result, empty or not, is cached.
+        progress = MISSING if refresh else progress_cache.get(user_id)
+        if progress is MISSING:
+            progress = live_progress(user_id)
+            progress_cache.set(user_id, progress)
+    # The rows are small and carry computed_at, so the body itself is the
+    # version; a separate version query would read the same few rows.
+    etag = make_etag(progress, "progress")
+    check_not_modified(if_none_match, etag)
+    return TimedJSONResponse(progress, headers={"ETag": etag})
+
+# ---------- Schema ----------
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# The hot read paths; `python main.py check-plans` fails if any of them needs
+# a sequential scan. Daily spend runs against the transactions database, whose
+# indexes are api_transactions' migrations.
+PLAN_CHECKS = [
+    ("get_user_campaigns", USER_CAMPAIGNS_SQL, (1,)),
+    ("get_user_progress", USER_PROGRESS_SQL, (1,)),
+    ("recompute_progress (assignments)", ASSIGNMENTS_SQL, (0, 1000)),
+]
+TRANSACTIONS_PLAN_CHECKS = [
+    ("recompute_progress (daily spend)", DAILY_SPEND_SQL,
+     {"after": 0, "last": 1000, "since": date(2024, 1, 1), "until": date(2024, 4, 1)}),
+]
+# The campaign catalogue grows with marketing, not with users: joins may walk it.
+PLAN_SMALL_TABLES = ("campaigns",)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance commands for api_metas")
+    commands = parser.add_subparsers(dest="command", required=True)
+    recompute = commands.add_parser("recompute-progress", help="Recompute campaign_progress for every user")
+    recompute.add_argument("--chunk-users", type=int, help="users per batch (default PROGRESS_CHUNK_USERS)")
+    commands.add_parser("migrate", help="Apply pending schema migrations")
+    commands.add_parser("check-plans", help="Fail if a hot query plans a sequential scan")
+    args = parser.parse_args()
+    status = 0
+    if args.command == "recompute-progress":
+        print("computed %d assignments" % recompute_all_progress(args.chunk_users))
+    elif args.command == "migrate":
+        conn = psycopg2.connect(**db.dsn)
+        try:
+            print("applied: %s" % (", ".join(migrate(conn, MIGRATIONS_DIR)) or "nothing"))
+        finally:
+            conn.close()
+    elif args.command == "check-plans":
+        status = run_plan_checks(
+            [(db, PLAN_CHECKS), (transactions_db, TRANSACTIONS_PLAN_CHECKS)], small_tables=PLAN_SMALL_TABLES
+        )
+    db.close()
+    transactions_db.close()
+    raise SystemExit(status)
@@ -0,0 +1,17 @@
+-- api_metas/migrations/0001_initial.sql
+-- user_campaigns' primary key leads with user_id and serves the per-user
+-- lookups; campaign_progress' does the same for progress reads.
+CREATE TABLE IF NOT EXISTS campaigns (
+    id SERIAL PRIMARY KEY, name TEXT NOT NULL, goal NUMERIC(14, 2) NOT NULL,
+    cashback_percentage NUMERIC(5, 2) NOT NULL, start_date DATE NOT NULL, end_date DATE NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active'
+);
+CREATE TABLE IF NOT EXISTS user_campaigns (
+    user_id INTEGER NOT NULL, campaign_id INTEGER NOT NULL REFERENCES campaigns (id),
+    PRIMARY KEY (user_id, campaign_id)
+);
+CREATE TABLE IF NOT EXISTS campaign_progress (
+    user_id INTEGER NOT NULL, campaign_id INTEGER NOT NULL, spent NUMERIC(14, 2) NOT NULL,
+    progress REAL NOT NULL, cashback NUMERIC(14, 2) NOT NULL, completed BOOLEAN NOT NULL,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (user_id, campaign_id)
+);
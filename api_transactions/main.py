@@ -1,13 +1,125 @@
 # api_transactions/main.py
+import argparse
+import json
 import os
-from fastapi import FastAPI, HTTPException, Path
+from datetime import date, timedelta
+from decimal import Decimal
+from fastapi import FastAPI, Header, HTTPException, Path, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 import psycopg2
+import psycopg2.extras
+from pydantic import ValidationError
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from common.admission import BULK, AdmissionController, AdmissionMiddleware, default_priority, query_flag
+from common.aio import AsyncDatabase
+from common.batch import in_request_order, parse_ids
+from common.db import ConnectionPool
+from common.encoding import dumps_json, negotiate
+from common.etag import check_not_modified, make_etag
+from common.export import (
+    EXTENSIONS, MEDIA_TYPES, ExportLimiter, begin_snapshot, check_format, encode_stream, fetch_batches,
+    format_available, run_job,
+)
+from common.metrics import TimedJSONResponse, TimedRowsResponse, install_metrics
+from common.migrate import migrate, run_plan_checks
+from common.prepared import prepared
+from common.replica import ReadYourWritesMiddleware, ReplicaSet, sticky_request
+from common.singleflight import SingleFlight
+from common.sql import partial_update
+from common.tracing import install_observability
+from common.writebuffer import WRITE_BUFFER_ENABLED, GroupCommitWriter
+
+app = FastAPI(title="API Transactions", default_response_class=TimedJSONResponse)
+
+# Bodies of at least GZIP_MIN_SIZE bytes are gzipped for clients that accept it.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+# Database connection for CORE TRANSACTIONS
+DB_HOST = os.getenv("DATABASE_HOST", "172.31.82.228")
+DB_PORT = os.getenv("DATABASE_PORT", "5433")
+DB_NAME = os.getenv("DATABASE_NAME", "core_transactions")
+DB_USER = os.getenv("DATABASE_USER", "postgres")
+DB_PASSWORD = os.getenv("DATABASE_PASSWORD", "postgres")
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "50000"))
+BATCH_PAGE_SIZE = int(os.getenv("BATCH_PAGE_SIZE", "1000"))
+
+db = ConnectionPool(
+    host=DB_HOST, port=DB_PORT,
+    dbname=DB_NAME, user=DB_USER,
+    password=DB_PASSWORD
+)
+# Opt-in asyncpg path (DATABASE_ASYNC=1) for the hottest read handlers.
+adb = AsyncDatabase(
+    db, host=DB_HOST, port=DB_PORT,
+    dbname=DB_NAME, user=DB_USER,
+    password=DB_PASSWORD
+)
+# GET handlers read from DATABASE_REPLICAS when configured, with lag-aware
+# fallback to the primary; writes always use db (see common/replica.py).
+replicas = ReplicaSet(db, adb, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+app.add_middleware(ReadYourWritesMiddleware)
+
+# Opt-in group-commit buffers (WRITE_BUFFER=1) for create_transaction and
+# create_operation; registered below and flushed before the pool closes.
+writers = []
+
+@app.on_event("startup")
+def open_pool():
+    db.open()
+    replicas.open()
+    for writer in writers:
+        writer.start()
+
+@app.on_event("startup")
+async def open_async_pool():
+    await adb.open()
+    await replicas.open_async()
 
-app = FastAPI(title="API Transactions")
+@app.on_event("shutdown")
+async def close_async_pool():
+    await replicas.close_async()
+    await adb.close()
 
+@app.on_event("shutdown")
+def close_pool():
+    for writer in writers:
+        writer.close()
+    replicas.close()
+    db.close()
+
+@app.get("/stats/pool")
+def get_pool_stats():
+    return {**db.stats(), "async": adb.stats(), "replicas": replicas.stats()}
+
+# Concurrent identical reads share one in-flight query (see @flight.coalesce),
+# except for requests pinned to the primary, which must not be served a
+# replica read started by another client.
+flight = SingleFlight(bypass=sticky_request)
+
+# Requests beyond an adaptive concurrency limit queue by priority and are
+# shed early with 429/503 and Retry-After (see common/admission.py). Added
+# before the metrics middleware so that rejections are still counted.
+admission = AdmissionController()
+
+def request_priority(scope):
+    # Exports run for minutes and would skew the latency samples: they have
+    # their own limit (EXPORT_MAX_CONCURRENT).
+    if scope["path"].startswith("/exports/"):
+        return None
+    # Bulk ingestion and full-history streams are shed before single-row work.
+    if scope["path"] == "/transactions/batch" or query_flag(scope, "stream"):
+        return BULK
+    return default_priority(scope)
+
+app.add_middleware(AdmissionMiddleware, controller=admission, classify=request_priority)
+# Starlette runs the last middleware added first: CORS goes on after
+# admission so that 429/503 rejections carry CORS headers too.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # You can also use ["*"] to allow all origins, but be cautious in production.
@@ -16,23 +128,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database connection for CORE TRANSACTIONS
-DB_HOST = os.getenv("DATABASE_HOST", "172.31.82.228")
-DB_PORT = os.getenv("DATABASE_PORT", "5433")
-DB_NAME = os.getenv("DATABASE_NAME", "core_transactions")
-DB_USER = os.getenv("DATABASE_USER", "postgres")
-DB_PASSWORD = os.getenv("DATABASE_PASSWORD", "postgres")
+# Prometheus-format /metrics: per-route latency, DB and serialization time.
+metrics = install_metrics(app)
+metrics.add_collector("db_pool", db.stats)
+metrics.add_collector("db_async_pool", adb.stats)
+metrics.add_collector("db_replicas", replicas.stats)
+metrics.add_collector("coalescing", flight.stats)
+metrics.add_collector("admission", admission.stats)
+install_observability(app, db, metrics)
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT,
-            dbname=DB_NAME, user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Database connection error")
+@app.get("/stats/coalescing")
+def get_coalescing_stats():
+    return flight.stats()
+
+@app.get("/stats/admission")
+def get_admission_stats():
+    return admission.stats()
 
 # ----- Models for Transaction Management -----
 class Transaction(BaseModel):
@@ -41,7 +152,7 @@ class Transaction(BaseModel):
     merchant: str
     account_type: str
     status: Optional[str] = "active"
-    # In a real scenario, you might include a field to indicate which transaction table to use.
+    source: Literal["mastercard", "paypal", "internal"] = "mastercard"  # selects the transactions_* table
 
 class TransactionUpdate(BaseModel):
     amount: Optional[float] = None
@@ -57,162 +168,661 @@ class Operation(BaseModel):
 class OperationUpdate(BaseModel):
     description: Optional[str] = None
 
+# ---------- Transaction sources ----------
+
+TRANSACTION_SOURCES = ("mastercard", "paypal", "internal")
+# Table and insert columns for each transaction source. Internal transfers
+# are keyed by sender_id and have no merchant.
+TRANSACTION_TABLES = {
+    "mastercard": ("transactions_mastercard", ("user_id", "amount", "merchant", "account_type", "status")),
+    "paypal": ("transactions_paypal", ("user_id", "amount", "merchant", "account_type", "status")),
+    "internal": ("transactions_internal", ("sender_id", "amount", "account_type", "status")),
+}
+
+# Public transaction IDs carry their source above bit SOURCE_SHIFT, so a
+# single-item lookup goes straight to one table by primary key. Mastercard is
+# source 0, which keeps its existing IDs unchanged, and IDs stay below 2**53
+# so JavaScript clients can hold them.
+SOURCE_SHIFT = 48
+
+def encode_transaction_id(src, raw_id):
+    return (src << SOURCE_SHIFT) | raw_id
+
+def decode_transaction_id(transaction_id):
+    src, raw_id = transaction_id >> SOURCE_SHIFT, transaction_id & ((1 << SOURCE_SHIFT) - 1)
+    if transaction_id < 0 or src >= len(TRANSACTION_SOURCES):
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return TRANSACTION_SOURCES[src], raw_id
+
+def select_transactions_sql(source):
+    # Rows come out shaped like USER_TRANSACTIONS_SQL and feed transaction_row.
+    table, columns = TRANSACTION_TABLES[source]
+    merchant = "merchant" if "merchant" in columns else "NULL"
+    # xmin comes last and versions the row for ETags.
+    return "SELECT id, %s, amount, %s, account_type, status, %d, xmin::text FROM %s" % (
+        columns[0], merchant, TRANSACTION_SOURCES.index(source), table
+    )
+
+def transaction_values(trx):
+    if trx.source == "internal":
+        return (trx.user_id, trx.amount, trx.account_type, trx.status)
+    return (trx.user_id, trx.amount, trx.merchant, trx.account_type, trx.status)
+
+def insert_transactions_sql(source):
+    # Returns the id and the stored values, e.g. the amount rounded to the
+    # column's scale, which is what the summaries must add up.
+    table, columns = TRANSACTION_TABLES[source]
+    return "INSERT INTO %s (%s) VALUES %%s RETURNING id, %s" % (table, ", ".join(columns), ", ".join(columns))
+
+# ---------- Per-user summaries ----------
+
+# One row per (user, source, merchant, account_type) with the count and total
+# of the user's live (not deleted) transactions. Every write path applies its
+# delta in the same database transaction as the write itself, so the summary
+# endpoint reads a few rows instead of the whole history. The table comes
+# from the migrations; backfill it with `python main.py rebuild-summaries`.
+UPSERT_SUMMARIES_SQL = """
+    INSERT INTO transaction_summaries AS s (user_id, source, merchant, account_type, count, total) VALUES %s
+    ON CONFLICT (user_id, source, merchant, account_type)
+    DO UPDATE SET count = s.count + EXCLUDED.count, total = s.total + EXCLUDED.total
+"""
+USER_SUMMARY_SQL = prepared("""
+    SELECT source, merchant, account_type, count, total, xmin::text FROM transaction_summaries
+    WHERE user_id = %s AND count <> 0
+    ORDER BY source, merchant, account_type
+""")
+
+def rebuild_summaries_sql(per_user):
+    branches = []
+    for source in TRANSACTION_SOURCES:
+        table, columns = TRANSACTION_TABLES[source]
+        merchant = "COALESCE(merchant, '')" if "merchant" in columns else "''"
+        branches.append("SELECT %s AS user_id, '%s' AS source, %s AS merchant, account_type, amount FROM %s "
+                        "WHERE status IS DISTINCT FROM 'deleted'%s" % (
+                            columns[0], source, merchant, table, " AND %s = %%s" % columns[0] if per_user else ""))
+    return (
+        "INSERT INTO transaction_summaries (user_id, source, merchant, account_type, count, total) "
+        "SELECT user_id, source, merchant, account_type, count(*), sum(amount) FROM (%s) t "
+        "GROUP BY user_id, source, merchant, account_type" % " UNION ALL ".join(branches)
+    )
+
+def summary_deltas(source, rows, sign=1, deltas=None):
+    # rows hold the insert columns of TRANSACTION_TABLES[source], in order.
+    deltas = {} if deltas is None else deltas
+    for values in rows:
+        row = dict(zip(TRANSACTION_TABLES[source][1], values))
+        if row["status"] == "deleted":
+            continue
+        key = (values[0], source, row.get("merchant") or "", row["account_type"])
+        count, total = deltas.get(key, (0, Decimal(0)))
+        deltas[key] = (count + sign, total + sign * Decimal(str(row["amount"])))
+    return deltas
+
+def apply_summary_deltas(cur, deltas):
+    # Sorted so that concurrent writers lock summary rows in the same order.
+    rows = [key + delta for key, delta in sorted(deltas.items()) if delta != (0, 0)]
+    if rows:
+        psycopg2.extras.execute_values(cur, UPSERT_SUMMARIES_SQL, rows, page_size=BATCH_PAGE_SIZE)
+
+def lock_transaction(cur, source, raw_id):
+    # Current values of a transaction, locked until the caller commits.
+    table, columns = TRANSACTION_TABLES[source]
+    cur.execute("SELECT %s FROM %s WHERE id = %%s FOR UPDATE" % (", ".join(columns), table), (raw_id,))
+    row = cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return row
+
+def rebuild_summaries(user_id=None):
+    with db.connection() as conn, conn.cursor() as cur:
+        # Blocks summary writes (not reads) until the rebuild commits. A write
+        # that has not reached its summary update yet waits here and applies
+        # its delta on top of the rebuilt rows.
+        cur.execute("LOCK TABLE transaction_summaries IN EXCLUSIVE MODE")
+        if user_id is None:
+            cur.execute("DELETE FROM transaction_summaries")
+            cur.execute(rebuild_summaries_sql(False))
+        else:
+            cur.execute("DELETE FROM transaction_summaries WHERE user_id = %s", (user_id,))
+            cur.execute(rebuild_summaries_sql(True), (user_id,) * len(TRANSACTION_SOURCES))
+        rebuilt = cur.rowcount
+        conn.commit()
+        return rebuilt
+
 # ---------- Endpoints for Transaction Management ----------
 
+TRANSACTION_SQL = {
+    source: prepared(select_transactions_sql(source) + " WHERE id = %s") for source in TRANSACTION_SOURCES
+}
+
 @app.get("/transactions/{transaction_id}")
-def get_transaction(transaction_id: int = Path(..., title="Transaction ID")):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # For demonstration, we query the transactions_mastercard table.
-        cur.execute("SELECT id, user_id, amount, merchant, account_type, status FROM transactions_mastercard WHERE id = %s", (transaction_id,))
+@flight.coalesce
+def get_transaction(
+    transaction_id: int = Path(..., title="Transaction ID"),
+    if_none_match: Optional[str] = Header(None),
+):
+    source, raw_id = decode_transaction_id(transaction_id)
+    with replicas.connection() as conn, conn.cursor() as cur:
+        cur.execute(TRANSACTION_SQL[source], (raw_id,))
         trx = cur.fetchone()
         if not trx:
             raise HTTPException(status_code=404, detail="Transaction not found")
-        return {
-            "id": trx[0],
-            "user_id": trx[1],
-            "amount": float(trx[2]),
-            "merchant": trx[3],
-            "account_type": trx[4],
-            "status": trx[5]
-        }
-    finally:
-        cur.close()
-        conn.close()
+    etag = make_etag(trx[7], "transaction")
+    check_not_modified(if_none_match, etag)
+    return TimedJSONResponse(transaction_row(trx), headers={"ETag": etag})
 
-@app.get("/users/{user_id}/transactions")
-def get_user_transactions(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # Here we union transactions from three tables for demonstration.
-        query = """
-            SELECT id, user_id, amount, merchant, account_type, status FROM transactions_mastercard WHERE user_id = %s
-            UNION
-            SELECT id, user_id, amount, merchant, account_type, status FROM transactions_paypal WHERE user_id = %s
-            UNION
-            SELECT id, sender_id, amount, NULL, account_type, status FROM transactions_internal WHERE sender_id = %s
-        """
-        cur.execute(query, (user_id, user_id, user_id))
-        transactions = cur.fetchall()
-        return [
-            {
-                "id": row[0],
-                "user_id": row[1],
-                "amount": float(row[2]),
-                "merchant": row[3],
-                "account_type": row[4],
-                "status": row[5]
-            } for row in transactions
-        ]
-    finally:
-        cur.close()
-        conn.close()
+BATCH_TRANSACTIONS_SQL = prepared(" UNION ALL ".join(
+    select_transactions_sql(source) + " WHERE id = ANY(%s)" for source in TRANSACTION_SOURCES
+))
+BATCH_TRANSACTIONS_VERSION_SQL = prepared(
+    "SELECT md5(string_agg(version, ',' ORDER BY version)) FROM (%s) t" % " UNION ALL ".join(
+        "SELECT '%d.' || id || ':' || xmin AS version FROM %s WHERE id = ANY(%%s)" % (src, TRANSACTION_TABLES[source][0])
+        for src, source in enumerate(TRANSACTION_SOURCES)
+    )
+)
 
-@app.post("/transactions", status_code=201)
-def create_transaction(trx: Transaction):
-    conn = get_db_connection()
-    cur = conn.cursor()
+@app.get("/transactions")
+def get_transactions(
+    ids: str = Query(..., description="Comma-separated transaction IDs"),
+    if_none_match: Optional[str] = Header(None),
+):
+    transaction_ids = parse_ids(ids)
+    raw_ids = {source: [] for source in TRANSACTION_SOURCES}
+    for transaction_id in set(transaction_ids):
+        if 0 <= transaction_id >> SOURCE_SHIFT < len(TRANSACTION_SOURCES):
+            source, raw_id = decode_transaction_id(transaction_id)
+            raw_ids[source].append(raw_id)
+    params = tuple(raw_ids[source] for source in TRANSACTION_SOURCES)
+    with replicas.connection() as conn, conn.cursor() as cur:
+        # Cheap version check first: a matching If-None-Match skips the rows.
+        cur.execute(BATCH_TRANSACTIONS_VERSION_SQL, params)
+        etag = make_etag(cur.fetchone()[0], "transactions", tuple(transaction_ids))
+        check_not_modified(if_none_match, etag)
+        cur.execute(BATCH_TRANSACTIONS_SQL, params)
+        rows = cur.fetchall()
+    found = {}
+    for row in rows:
+        trx = transaction_row(row)
+        found[trx["id"]] = trx
+    return TimedJSONResponse(in_request_order(transaction_ids, found), headers={"ETag": etag})
+
+# The three sources are merged on (id, source) so that pages are stable even
+# though each table has its own id sequence. Each branch only reads the rows
+# after the cursor and at most one page, which an index on (user_id, id) serves
+# directly. LIMIT NULL means no limit and is used by the streaming mode.
+USER_TRANSACTIONS_SQL = prepared("""
+    SELECT id, user_id, amount, merchant, account_type, status, src, xmin FROM (
+        (SELECT id, user_id, amount, merchant, account_type, status, 0 AS src, xmin::text FROM transactions_mastercard
+         WHERE user_id = %s AND id >= %s ORDER BY id LIMIT %s)
+        UNION ALL
+        (SELECT id, user_id, amount, merchant, account_type, status, 1 AS src, xmin::text FROM transactions_paypal
+         WHERE user_id = %s AND id >= %s ORDER BY id LIMIT %s)
+        UNION ALL
+        (SELECT id, sender_id, amount, NULL, account_type, status, 2 AS src, xmin::text FROM transactions_internal
+         WHERE sender_id = %s AND id >= %s ORDER BY id LIMIT %s)
+    ) t
+    WHERE (id, src) > (%s, %s)
+    ORDER BY id, src
+    LIMIT %s
+""")
+# Version of a page: its rows, and the extra row that decides the next
+# cursor, hashed in the database.
+USER_TRANSACTIONS_VERSION_SQL = prepared(
+    "SELECT md5(string_agg(id || '.' || src || ':' || xmin, ',' ORDER BY id, src)) FROM (%s) page"
+    % USER_TRANSACTIONS_SQL
+)
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+def encode_cursor(row):
+    return "%d.%d" % (row[0], row[6])
+
+def decode_cursor(after):
+    if after is None:
+        return 0, -1
     try:
-        # For demonstration, we insert into transactions_mastercard.
-        cur.execute(
-            "INSERT INTO transactions_mastercard (user_id, amount, merchant, account_type, status) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-            (trx.user_id, trx.amount, trx.merchant, trx.account_type, trx.status)
+        trx_id, src = (int(part) for part in after.split("."))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return trx_id, src
+
+def user_transactions_params(user_id, after_id, after_src, fetch):
+    # Every branch may return the cursor row itself, hence the extra row.
+    branch_limit = None if fetch is None else fetch + 1
+    return (
+        user_id, after_id, branch_limit,
+        user_id, after_id, branch_limit,
+        user_id, after_id, branch_limit,
+        after_id, after_src, fetch,
+    )
+
+TRANSACTION_COLUMNS = ("id", "user_id", "amount", "merchant", "account_type", "status", "source")
+
+def transaction_fields(row):
+    # row: id, user_id, amount, merchant, account_type, status, source code
+    return (
+        encode_transaction_id(row[6], row[0]), row[1], float(row[2]), row[3], row[4], row[5], TRANSACTION_SOURCES[row[6]]
+    )
+
+def transaction_row(row):
+    return dict(zip(TRANSACTION_COLUMNS, transaction_fields(row)))
+
+def stream_user_transactions(params):
+    # Server-side cursor: rows are fetched STREAM_BATCH_SIZE at a time, so
+    # memory stays flat no matter how long the history is.
+    with replicas.connection() as conn, conn.cursor(name="user_transactions") as cur:
+        cur.itersize = STREAM_BATCH_SIZE
+        cur.execute(USER_TRANSACTIONS_SQL, params)
+        for row in cur:
+            yield dumps_json(transaction_row(row)) + b"\n"
+
+@app.get("/users/{user_id}/transactions")
+async def get_user_transactions(
+    user_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = Query(None, description="Cursor returned in X-Next-Cursor"),
+    stream: bool = Query(False, description="Stream the whole history as NDJSON"),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    after_id, after_src = decode_cursor(after)
+    if stream:
+        params = user_transactions_params(user_id, after_id, after_src, limit)
+        return StreamingResponse(stream_user_transactions(params), media_type="application/x-ndjson")
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    # Fetch one extra row to know whether there is a next page.
+    params = user_transactions_params(user_id, after_id, after_src, limit + 1)
+    # Cheap version check first: a matching If-None-Match skips fetching and
+    # encoding the page.
+    version = await replicas.fetch_all(USER_TRANSACTIONS_VERSION_SQL, params)
+    etag = make_etag(version[0][0], "user_transactions", user_id, after, limit, negotiate(accept))
+    check_not_modified(if_none_match, etag, vary="Accept")
+    transactions = await replicas.fetch_all(USER_TRANSACTIONS_SQL, params)
+    headers = {"ETag": etag}
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(transactions[-1])
+    return TimedRowsResponse(TRANSACTION_COLUMNS, [transaction_fields(row) for row in transactions], accept, headers=headers)
+
+@app.get("/users/{user_id}/transactions/summary")
+@flight.coalesce
+async def get_user_transactions_summary(user_id: int, if_none_match: Optional[str] = Header(None)):
+    rows = await replicas.fetch_all(USER_SUMMARY_SQL, (user_id,))
+    etag = make_etag(tuple((row[0], row[1], row[2], row[5]) for row in rows), "summary", user_id)
+    check_not_modified(if_none_match, etag)
+    count, total = 0, Decimal(0)
+    groups = {"by_source": {}, "by_account_type": {}, "by_merchant": {}}
+    for source, merchant, account_type, row_count, row_total, _ in rows:
+        count += row_count
+        total += row_total
+        for group, key in (("by_source", source), ("by_account_type", account_type), ("by_merchant", merchant)):
+            if key:  # internal transfers have no merchant
+                bucket = groups[group].setdefault(key, [0, Decimal(0)])
+                bucket[0] += row_count
+                bucket[1] += row_total
+    return TimedJSONResponse({
+        "user_id": user_id,
+        "count": count,
+        "total": float(total),
+        **{
+            group: {key: {"count": bucket[0], "total": float(bucket[1])} for key, bucket in buckets.items()}
+            for group, buckets in groups.items()
+        }
+    }, headers={"ETag": etag})
+
+def summary_flush(source):
+    # on_flush hook: group-committed rows update the summaries in their own transaction.
+    def on_flush(cur, rows, returned):
+        apply_summary_deltas(cur, summary_deltas(source, [row[1:] for row in returned]))
+    return on_flush
+
+transaction_writers = {}
+if WRITE_BUFFER_ENABLED:
+    for source in TRANSACTION_SOURCES:
+        transaction_writers[source] = GroupCommitWriter(
+            db, insert_transactions_sql(source), "transactions_" + source, on_flush=summary_flush(source)
         )
-        trx_id = cur.fetchone()[0]
+        writers.append(transaction_writers[source])
+        metrics.add_collector("write_buffer_transactions_" + source, transaction_writers[source].stats)
+
+def insert_transaction(trx):
+    with db.connection() as conn, conn.cursor() as cur:
+        # psycopg2 adapts the values tuple to a single "(v1, v2, ...)" row.
+        cur.execute(insert_transactions_sql(trx.source), (transaction_values(trx),))
+        stored = cur.fetchone()
+        apply_summary_deltas(cur, summary_deltas(trx.source, [stored[1:]]))
         conn.commit()
-        return {"id": trx_id}
-    finally:
-        cur.close()
-        conn.close()
+        return stored[0]
+
+@app.post("/transactions", status_code=201)
+async def create_transaction(trx: Transaction):
+    if transaction_writers:
+        trx_id = await transaction_writers[trx.source].write(transaction_values(trx))
+    else:
+        trx_id = await run_in_threadpool(insert_transaction, trx)
+    return {"id": encode_transaction_id(TRANSACTION_SOURCES.index(trx.source), trx_id)}
+
+def parse_batch_body(body, content_type):
+    try:
+        if content_type.startswith("application/x-ndjson"):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    return items
+
+def validation_message(exc):
+    return "; ".join("%s: %s" % (".".join(str(part) for part in err["loc"]), err["msg"]) for err in exc.errors())
+
+def insert_transactions_batch(rows_by_source):
+    # One transaction for the whole batch; each source is loaded with
+    # multi-row INSERTs of BATCH_PAGE_SIZE rows.
+    ids_by_source = {}
+    deltas = {}
+    with db.connection() as conn, conn.cursor() as cur:
+        try:
+            for source, rows in rows_by_source.items():
+                stored = psycopg2.extras.execute_values(
+                    cur, insert_transactions_sql(source), [values for _, values in rows],
+                    page_size=BATCH_PAGE_SIZE, fetch=True
+                )
+                ids_by_source[source] = [row[0] for row in stored]
+                summary_deltas(source, [row[1:] for row in stored], deltas=deltas)
+            apply_summary_deltas(cur, deltas)
+            conn.commit()
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            raise HTTPException(status_code=422, detail="Batch rejected: %s" % e.pgerror)
+    return ids_by_source
+
+@app.post("/transactions/batch")
+async def create_transactions_batch(request: Request):
+    items = parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > BATCH_MAX_ROWS:
+        raise HTTPException(status_code=413, detail="At most %d rows per batch" % BATCH_MAX_ROWS)
+
+    results = [None] * len(items)
+    rows_by_source = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {"index": index, "error": "Row must be a JSON object"}
+            continue
+        try:
+            trx = Transaction(**item)
+        except ValidationError as e:
+            results[index] = {"index": index, "error": validation_message(e)}
+            continue
+        rows_by_source.setdefault(trx.source, []).append((index, transaction_values(trx)))
+
+    if rows_by_source:
+        ids_by_source = await run_in_threadpool(insert_transactions_batch, rows_by_source)
+        for source, rows in rows_by_source.items():
+            for (index, _), trx_id in zip(rows, ids_by_source[source]):
+                results[index] = {
+                    "index": index,
+                    "id": encode_transaction_id(TRANSACTION_SOURCES.index(source), trx_id),
+                    "source": source
+                }
+
+    inserted = sum(1 for result in results if "id" in result)
+    return JSONResponse(
+        status_code=201 if inserted or not results else 422,
+        content={"inserted": inserted, "failed": len(results) - inserted, "results": results}
+    )
 
 @app.put("/transactions/{transaction_id}")
 def update_transaction(transaction_id: int, trx_update: TransactionUpdate):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # Update fields in transactions_mastercard table as an example.
-        if trx_update.amount is not None:
-            cur.execute("UPDATE transactions_mastercard SET amount = %s WHERE id = %s", (trx_update.amount, transaction_id))
-        if trx_update.merchant:
-            cur.execute("UPDATE transactions_mastercard SET merchant = %s WHERE id = %s", (trx_update.merchant, transaction_id))
-        if trx_update.account_type:
-            cur.execute("UPDATE transactions_mastercard SET account_type = %s WHERE id = %s", (trx_update.account_type, transaction_id))
-        if trx_update.status:
-            cur.execute("UPDATE transactions_mastercard SET status = %s WHERE id = %s", (trx_update.status, transaction_id))
+    source, raw_id = decode_transaction_id(transaction_id)
+    table, columns = TRANSACTION_TABLES[source]
+    if trx_update.merchant is not None and "merchant" not in columns:
+        raise HTTPException(status_code=422, detail="Internal transfers have no merchant")
+    with db.connection() as conn, conn.cursor() as cur:
+        old = lock_transaction(cur, source, raw_id)
+        row = partial_update(cur, table, trx_update, {"id": raw_id}, ("id",) + columns)
+        deltas = summary_deltas(source, [old], sign=-1)
+        apply_summary_deltas(cur, summary_deltas(source, [row[1:]], deltas=deltas))
         conn.commit()
-        return {"message": "Transaction updated successfully"}
-    finally:
-        cur.close()
-        conn.close()
+        values = dict(zip(("id",) + columns, row))
+        return transaction_row((
+            values["id"], values.get("user_id", values.get("sender_id")), values["amount"],
+            values.get("merchant"), values["account_type"], values["status"], TRANSACTION_SOURCES.index(source)
+        ))
 
 @app.delete("/transactions/{transaction_id}")
 def delete_transaction(transaction_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # Logical deletion: update status to 'deleted' in all transaction tables (example using transactions_mastercard).
-        cur.execute("UPDATE transactions_mastercard SET status = 'deleted' WHERE id = %s", (transaction_id,))
+    source, raw_id = decode_transaction_id(transaction_id)
+    with db.connection() as conn, conn.cursor() as cur:
+        old = lock_transaction(cur, source, raw_id)
+        # Logical deletion: update status to 'deleted' in the transaction's own table.
+        cur.execute("UPDATE %s SET status = 'deleted' WHERE id = %%s" % TRANSACTION_TABLES[source][0], (raw_id,))
+        apply_summary_deltas(cur, summary_deltas(source, [old], sign=-1))
         conn.commit()
         return {"message": "Transaction logically deleted"}
-    finally:
-        cur.close()
-        conn.close()
 
 # ---------- Endpoints for Operations Management ----------
 
 @app.get("/operations/{operation_id}")
-def get_operation(operation_id: int = Path(..., title="Operation ID")):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id, user_id, description FROM operations WHERE id = %s", (operation_id,))
+@flight.coalesce
+def get_operation(
+    operation_id: int = Path(..., title="Operation ID"),
+    if_none_match: Optional[str] = Header(None),
+):
+    with replicas.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, user_id, description, xmin::text FROM operations WHERE id = %s", (operation_id,))
         op = cur.fetchone()
         if not op:
             raise HTTPException(status_code=404, detail="Operation not found")
-        return {"id": op[0], "user_id": op[1], "description": op[2]}
-    finally:
-        cur.close()
-        conn.close()
+    etag = make_etag(op[3], "operation")
+    check_not_modified(if_none_match, etag)
+    return TimedJSONResponse({"id": op[0], "user_id": op[1], "description": op[2]}, headers={"ETag": etag})
+
+OPERATIONS_VERSION_SQL = prepared(
+    "SELECT md5(string_agg(id || ':' || xmin, ',' ORDER BY id)) FROM operations WHERE user_id = %s"
+)
+USER_OPERATIONS_SQL = prepared("SELECT id, description FROM operations WHERE user_id = %s ORDER BY id")
 
 @app.get("/users/{user_id}/operations")
-def get_user_operations(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id, description FROM operations WHERE user_id = %s", (user_id,))
-        ops = cur.fetchall()
-        return [{"id": row[0], "description": row[1]} for row in ops]
-    finally:
-        cur.close()
-        conn.close()
+@flight.coalesce
+def get_user_operations(
+    user_id: int, accept: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)
+):
+    with replicas.connection() as conn, conn.cursor() as cur:
+        cur.execute(OPERATIONS_VERSION_SQL, (user_id,))
+        etag = make_etag(cur.fetchone()[0], "operations", negotiate(accept))
+        check_not_modified(if_none_match, etag, vary="Accept")
+        cur.execute(USER_OPERATIONS_SQL, (user_id,))
+        return TimedRowsResponse(("id", "description"), cur.fetchall(), accept, headers={"ETag": etag})
 
-@app.post("/operations", status_code=201)
-def create_operation(op: Operation):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+operation_writer = None
+if WRITE_BUFFER_ENABLED:
+    operation_writer = GroupCommitWriter(db, "INSERT INTO operations (user_id, description) VALUES %s RETURNING id", "operations")
+    writers.append(operation_writer)
+    metrics.add_collector("write_buffer_operations", operation_writer.stats)
+
+def insert_operation(op):
+    with db.connection() as conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO operations (user_id, description) VALUES (%s, %s) RETURNING id",
             (op.user_id, op.description)
         )
         op_id = cur.fetchone()[0]
         conn.commit()
-        return {"id": op_id}
-    finally:
-        cur.close()
-        conn.close()
+        return op_id
+
+@app.post("/operations", status_code=201)
+async def create_operation(op: Operation):
+    if operation_writer is not None:
+        op_id = await operation_writer.write((op.user_id, op.description))
+    else:
+        op_id = await run_in_threadpool(insert_operation, op)
+    return {"id": op_id}
 
 @app.put("/operations/{operation_id}")
 def update_operation(operation_id: int, op_update: OperationUpdate):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        if op_update.description:
-            cur.execute("UPDATE operations SET description = %s WHERE id = %s", (op_update.description, operation_id))
+    with db.connection() as conn, conn.cursor() as cur:
+        op = partial_update(cur, "operations", op_update, {"id": operation_id}, ("id", "user_id", "description"))
+        if not op:
+            raise HTTPException(status_code=404, detail="Operation not found")
         conn.commit()
-        return {"message": "Operation updated successfully"}
+        return {"id": op[0], "user_id": op[1], "description": op[2]}
+
+# ---------- Exports ----------
+
+# Full dumps for finance, in id order so that an interrupted export resumes
+# with after=<last id received>. Transactions come source by source, and
+# their public ids grow with the source, so one id orders all of them.
+EXPORT_TRANSACTION_COLUMNS = (
+    ("id", "int"), ("user_id", "int"), ("amount", "float"), ("merchant", "str"),
+    ("account_type", "str"), ("status", "str"), ("source", "str"), ("created_at", "timestamp"),
+)
+EXPORT_OPERATION_COLUMNS = (("id", "int"), ("user_id", "int"), ("description", "str"), ("created_at", "timestamp"))
+
+def export_filters(from_user, to_user, since, until):
+    # since and until are inclusive dates.
+    return {
+        "from_user": from_user, "to_user": to_user, "since": since,
+        "until": until + timedelta(days=1) if until is not None else None,
+    }
+
+def export_filters_sql(user_column, filters):
+    conditions = []
+    if filters["from_user"] is not None:
+        conditions.append("%s >= %%(from_user)s" % user_column)
+    if filters["to_user"] is not None:
+        conditions.append("%s <= %%(to_user)s" % user_column)
+    if filters["since"] is not None:
+        conditions.append("created_at >= %(since)s")
+    if filters["until"] is not None:
+        conditions.append("created_at < %(until)s")
+    return "".join(" AND " + condition for condition in conditions)
+
+def export_transactions_sql(source, filters):
+    table, columns = TRANSACTION_TABLES[source]
+    merchant = "merchant" if "merchant" in columns else "NULL"
+    return (
+        "SELECT (%d::bigint << %d) | id, %s, amount::float8, %s, account_type, status, '%s', created_at FROM %s "
+        "WHERE id > %%(after)s" % (TRANSACTION_SOURCES.index(source), SOURCE_SHIFT, columns[0], merchant, source, table)
+    ) + export_filters_sql(columns[0], filters) + " ORDER BY id"
+
+def export_transaction_batches(conn, filters, after):
+    start_src, after_id = (0, 0) if after is None else (after >> SOURCE_SHIFT, after & ((1 << SOURCE_SHIFT) - 1))
+    for src, source in enumerate(TRANSACTION_SOURCES):
+        if src >= start_src:
+            params = {**filters, "after": after_id if src == start_src else 0}
+            yield from fetch_batches(conn, "export_" + source, export_transactions_sql(source, filters), params)
+
+def export_operation_batches(conn, filters, after):
+    sql = (
+        "SELECT id, user_id, description, created_at FROM operations WHERE id > %(after)s"
+        + export_filters_sql("user_id", filters) + " ORDER BY id"
+    )
+    yield from fetch_batches(conn, "export_operations", sql, {**filters, "after": after or 0})
+
+EXPORTS = {
+    "transactions": (EXPORT_TRANSACTION_COLUMNS, export_transaction_batches),
+    "operations": (EXPORT_OPERATION_COLUMNS, export_operation_batches),
+}
+exports = ExportLimiter()
+metrics.add_collector("exports", exports.stats)
+
+@app.get("/stats/exports")
+def get_export_stats():
+    return exports.stats()
+
+def stream_export(kind, fmt, filters, after, header, slot):
+    columns, batches = EXPORTS[kind]
+    try:
+        with replicas.connection() as conn:
+            begin_snapshot(conn)
+            yield from encode_stream(fmt, columns, batches(conn, filters, after), header)
     finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        slot.release()
+
+@app.get("/exports/{kind}")
+def export_rows(
+    kind: Literal["transactions", "operations"],
+    fmt: Literal["csv", "columnar", "parquet"] = Query("csv", alias="format"),
+    from_user: Optional[int] = Query(None, description="Lowest user id, inclusive"),
+    to_user: Optional[int] = Query(None, description="Highest user id, inclusive"),
+    since: Optional[date] = Query(None, description="First creation date, inclusive"),
+    until: Optional[date] = Query(None, description="Last creation date, inclusive"),
+    after: Optional[int] = Query(None, ge=0, description="Resume after this id (the last one received)"),
+    header: bool = Query(True, description="Start CSV output with a header row"),
+):
+    # Streams from server-side cursors EXPORT_BATCH_SIZE rows at a time, so
+    # memory stays flat however large the export.
+    check_format(fmt)
+    slot = exports.acquire()
+    filters = export_filters(from_user, to_user, since, until)
+    return StreamingResponse(
+        stream_export(kind, fmt, filters, after, header, slot),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": 'attachment; filename="%s.%s"' % (kind, EXTENSIONS[fmt])},
+        background=BackgroundTask(slot.release),
+    )
+
+# ---------- Schema ----------
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# The hot read paths; `python main.py check-plans` fails if any of them needs
+# a sequential scan.
+PLAN_CHECKS = [
+    ("get_transaction", TRANSACTION_SQL["mastercard"], (1,)),
+    ("get_transactions (version)", BATCH_TRANSACTIONS_VERSION_SQL, ([1], [1], [1])),
+    ("get_transactions", BATCH_TRANSACTIONS_SQL, ([1], [1], [1])),
+    ("get_user_transactions (version)", USER_TRANSACTIONS_VERSION_SQL,
+     user_transactions_params(1, 0, -1, DEFAULT_PAGE_SIZE + 1)),
+    ("get_user_transactions", USER_TRANSACTIONS_SQL, user_transactions_params(1, 0, -1, DEFAULT_PAGE_SIZE + 1)),
+    ("get_user_transactions_summary", USER_SUMMARY_SQL, (1,)),
+    ("rebuild_summaries --user-id", rebuild_summaries_sql(True), (1,) * len(TRANSACTION_SOURCES)),
+    ("get_user_operations (version)", OPERATIONS_VERSION_SQL, (1,)),
+    ("get_user_operations", USER_OPERATIONS_SQL, (1,)),
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance commands for api_transactions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild-summaries", help="Create and backfill transaction_summaries")
+    rebuild.add_argument("--user-id", type=int, help="only rebuild this user")
+    commands.add_parser("migrate", help="Apply pending schema migrations")
+    commands.add_parser("check-plans", help="Fail if a hot query plans a sequential scan")
+    export = commands.add_parser("export", help="Export to part files, resuming from the directory's checkpoint")
+    export.add_argument("kind", choices=sorted(EXPORTS))
+    export.add_argument("directory")
+    export.add_argument("--format", default="csv", choices=sorted(EXTENSIONS))
+    export.add_argument("--from-user", type=int)
+    export.add_argument("--to-user", type=int)
+    export.add_argument("--since", type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    export.add_argument("--until", type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+    args = parser.parse_args()
+    status = 0
+    if args.command == "rebuild-summaries":
+        print("rebuilt %d summary rows" % rebuild_summaries(args.user_id))
+    elif args.command == "migrate":
+        conn = psycopg2.connect(**db.dsn)
+        try:
+            print("applied: %s" % (", ".join(migrate(conn, MIGRATIONS_DIR)) or "nothing"))
+        finally:
+            conn.close()
+    elif args.command == "check-plans":
+        status = run_plan_checks([(db, PLAN_CHECKS)])
+    elif args.command == "export":
+        if not format_available(args.format):
+            parser.error("%s export needs pyarrow" % args.format)
+        columns, batches = EXPORTS[args.kind]
+        filters = export_filters(args.from_user, args.to_user, args.since, args.until)
+        job = {
+            "kind": args.kind, "format": args.format,
+            "filters": {name: str(value) if value is not None else None for name, value in filters.items()},
+        }
+
+        def batches_after(after):
+            with db.connection() as conn:
+                begin_snapshot(conn)
+                yield from batches(conn, filters, after)
+
+        state = run_job(args.directory, args.format, columns, batches_after, job)
+        print("exported %d rows in %d parts" % (state["rows"], state["parts"]))
+    db.close()
+    raise SystemExit(status)
@@ -0,0 +1,24 @@
+-- api_transactions/migrations/0001_initial.sql
+CREATE TABLE IF NOT EXISTS transactions_mastercard (
+    id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, amount NUMERIC(14, 2) NOT NULL,
+    merchant TEXT, account_type TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'active',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS transactions_paypal (
+    id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, amount NUMERIC(14, 2) NOT NULL,
+    merchant TEXT, account_type TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'active',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS transactions_internal (
+    id SERIAL PRIMARY KEY, sender_id INTEGER NOT NULL, receiver_id INTEGER,
+    amount NUMERIC(14, 2) NOT NULL, account_type TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'active',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS operations (
+    id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, description TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS transaction_summaries (
+    user_id INTEGER NOT NULL, source TEXT NOT NULL, merchant TEXT NOT NULL, account_type TEXT NOT NULL,
+    count BIGINT NOT NULL, total NUMERIC NOT NULL, PRIMARY KEY (user_id, source, merchant, account_type)
+);
@@ -0,0 +1,23 @@
+-- api_transactions/migrations/0002_hot_indexes.sql
+-- migrate: no-transaction
+-- Tables created before 0001 have no created_at, which the spend indexes
+-- below key on. Existing rows take the time of the migration.
+ALTER TABLE transactions_mastercard ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE transactions_paypal ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
+-- A user's history is paged per table by (user_id, id); see USER_TRANSACTIONS_SQL.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_mastercard_user_id_idx
+    ON transactions_mastercard (user_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_paypal_user_id_idx
+    ON transactions_paypal (user_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_internal_sender_id_idx
+    ON transactions_internal (sender_id, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS operations_user_id_idx
+    ON operations (user_id, id) INCLUDE (description);
+-- Live card spend per user and day, for campaign progress (api_metas) and
+-- per-user summary rebuilds. Deleted rows are left out of the index.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_mastercard_live_spend_idx
+    ON transactions_mastercard (user_id, created_at) INCLUDE (amount, merchant, account_type)
+    WHERE status IS DISTINCT FROM 'deleted';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transactions_paypal_live_spend_idx
+    ON transactions_paypal (user_id, created_at) INCLUDE (amount, merchant, account_type)
+    WHERE status IS DISTINCT FROM 'deleted';
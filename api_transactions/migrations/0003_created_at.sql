@@ -0,0 +1,6 @@
+-- api_transactions/migrations/0003_created_at.sql
+-- The rest of the columns added after the first release (see 0002 for the
+-- card tables): exports filter every table on created_at. Existing rows take
+-- the time of the migration.
+ALTER TABLE transactions_internal ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE operations ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now();
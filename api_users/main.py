@@ -1,13 +1,91 @@
 # api_users/main.py
+import argparse
 import os
-from fastapi import FastAPI, HTTPException, Path
+import psycopg2
+from fastapi import FastAPI, Header, HTTPException, Path, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
-import psycopg2
+from common.admission import AdmissionController, AdmissionMiddleware
+from common.aio import AsyncDatabase
+from common.batch import in_request_order, parse_ids
+from common.db import ConnectionPool
+from common.encoding import negotiate
+from common.etag import check_not_modified, make_etag
+from common.kvstore import LogStore
+from common.metrics import TimedJSONResponse, TimedRowsResponse, install_metrics
+from common.migrate import migrate, run_plan_checks
+from common.prepared import prepared
+from common.replica import ReadYourWritesMiddleware, ReplicaSet, sticky_request
+from common.singleflight import SingleFlight
+from common.sql import partial_update
+from common.tracing import install_observability
+
+app = FastAPI(title="API Users", default_response_class=TimedJSONResponse)
+
+# Bodies of at least GZIP_MIN_SIZE bytes are gzipped for clients that accept it.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+# Database connection for CORE USERS
+DB_HOST = os.getenv("DATABASE_HOST", "172.31.82.228")
+DB_PORT = os.getenv("DATABASE_PORT", "5432")
+DB_NAME = os.getenv("DATABASE_NAME", "core_users")
+DB_USER = os.getenv("DATABASE_USER", "postgres")
+DB_PASSWORD = os.getenv("DATABASE_PASSWORD", "postgres")
+
+db = ConnectionPool(
+    host=DB_HOST, port=DB_PORT,
+    dbname=DB_NAME, user=DB_USER,
+    password=DB_PASSWORD
+)
+# Opt-in asyncpg path (DATABASE_ASYNC=1) for the hottest read handlers.
+adb = AsyncDatabase(
+    db, host=DB_HOST, port=DB_PORT,
+    dbname=DB_NAME, user=DB_USER,
+    password=DB_PASSWORD
+)
+# GET handlers read from DATABASE_REPLICAS when configured, with lag-aware
+# fallback to the primary; writes always use db (see common/replica.py).
+replicas = ReplicaSet(db, adb, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+app.add_middleware(ReadYourWritesMiddleware)
+
+@app.on_event("startup")
+def open_pool():
+    db.open()
+    replicas.open()
+
+@app.on_event("startup")
+async def open_async_pool():
+    await adb.open()
+    await replicas.open_async()
+
+@app.on_event("shutdown")
+async def close_async_pool():
+    await replicas.close_async()
+    await adb.close()
 
-app = FastAPI(title="API Users")
+@app.on_event("shutdown")
+def close_pool():
+    replicas.close()
+    db.close()
 
+@app.get("/stats/pool")
+def get_pool_stats():
+    return {**db.stats(), "async": adb.stats(), "replicas": replicas.stats()}
+
+# Concurrent identical reads share one in-flight query (see @flight.coalesce),
+# except for requests pinned to the primary, which must not be served a
+# replica read started by another client.
+flight = SingleFlight(bypass=sticky_request)
+
+# Requests beyond an adaptive concurrency limit queue by priority and are
+# shed early with 429/503 and Retry-After (see common/admission.py). Added
+# before the metrics middleware so that rejections are still counted.
+admission = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+# Starlette runs the last middleware added first: CORS goes on after
+# admission so that 429/503 rejections carry CORS headers too.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # You can also use ["*"] to allow all origins, but be cautious in production.
@@ -16,26 +94,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database connection for CORE USERS
-DB_HOST = os.getenv("DATABASE_HOST", "172.31.82.228")
-DB_PORT = os.getenv("DATABASE_PORT", "5432")
-DB_NAME = os.getenv("DATABASE_NAME", "core_users")
-DB_USER = os.getenv("DATABASE_USER", "postgres")
-DB_PASSWORD = os.getenv("DATABASE_PASSWORD", "postgres")
+# Prometheus-format /metrics: per-route latency, DB and serialization time.
+metrics = install_metrics(app)
+metrics.add_collector("db_pool", db.stats)
+metrics.add_collector("db_async_pool", adb.stats)
+metrics.add_collector("db_replicas", replicas.stats)
+metrics.add_collector("coalescing", flight.stats)
+metrics.add_collector("admission", admission.stats)
+install_observability(app, db, metrics)
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT,
-            dbname=DB_NAME, user=DB_USER,
-            password=DB_PASSWORD
-        )
-        return conn
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Database connection error")
+@app.get("/stats/coalescing")
+def get_coalescing_stats():
+    return flight.stats()
 
-# In-memory store for billetera_users (Wallet Management)
-wallet_store = {}
+@app.get("/stats/admission")
+def get_admission_stats():
+    return admission.stats()
+
+# Wallets (billetera_users) live in an embedded append-only store on local
+# disk, shared by all uvicorn workers of the container (see common/kvstore.py).
+WALLET_STORE_PATH = os.getenv("WALLET_STORE_PATH", "data/wallets.log")
+wallet_store = LogStore(WALLET_STORE_PATH)
+metrics.add_collector("wallet_store", wallet_store.stats)
+
+@app.on_event("startup")
+def open_wallet_store():
+    wallet_store.open()
+
+@app.on_event("shutdown")
+def close_wallet_store():
+    wallet_store.close()
+
+@app.get("/stats/wallet")
+def get_wallet_stats():
+    return wallet_store.stats()
 
 # ----- Models for User Management -----
 class User(BaseModel):
@@ -68,33 +160,52 @@ class CreditCardUpdate(BaseModel):
     expiration_date: Optional[str] = None
     status: Optional[str] = None
 
-# ----- Models for Wallet Management (NoSQL simulated) -----
+# ----- Models for Wallet Management -----
 class WalletItem(BaseModel):
     type: str  # e.g., "card" or "savings"
     details: dict
 
 # ---------- Endpoints for User Management ----------
 
+USER_SQL = prepared("SELECT id, name, email, xmin::text FROM users WHERE id = %s")
+USERS_VERSION_SQL = prepared("SELECT md5(string_agg(id || ':' || xmin, ',' ORDER BY id)) FROM users WHERE id = ANY(%s)")
+BATCH_USERS_SQL = prepared("SELECT id, name, email FROM users WHERE id = ANY(%s)")
+
 @app.get("/users/{user_id}")
-def get_user(user_id: int = Path(..., title="The ID of the user to retrieve")):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id, name, email FROM users WHERE id = %s", (user_id,))
+@flight.coalesce
+def get_user(
+    user_id: int = Path(..., title="The ID of the user to retrieve"),
+    if_none_match: Optional[str] = Header(None),
+):
+    with replicas.connection() as conn, conn.cursor() as cur:
+        cur.execute(USER_SQL, (user_id,))
         user = cur.fetchone()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
+        etag = make_etag(user[3], "user")
+        check_not_modified(if_none_match, etag)
         # In a real implementation, you would also join demographics, onboarding, and user_status.
-        return {"id": user[0], "name": user[1], "email": user[2]}
-    finally:
-        cur.close()
-        conn.close()
+        return TimedJSONResponse({"id": user[0], "name": user[1], "email": user[2]}, headers={"ETag": etag})
+
+@app.get("/users")
+def get_users(
+    ids: str = Query(..., description="Comma-separated user IDs"),
+    if_none_match: Optional[str] = Header(None),
+):
+    user_ids = parse_ids(ids)
+    with replicas.connection() as conn, conn.cursor() as cur:
+        # Cheap version check first: a matching If-None-Match skips the rows.
+        cur.execute(USERS_VERSION_SQL, (list(set(user_ids)),))
+        etag = make_etag(cur.fetchone()[0], "users", tuple(user_ids))
+        check_not_modified(if_none_match, etag)
+        cur.execute(BATCH_USERS_SQL, (list(set(user_ids)),))
+        rows = cur.fetchall()
+    found = {row[0]: {"id": row[0], "name": row[1], "email": row[2]} for row in rows}
+    return TimedJSONResponse(in_request_order(user_ids, found), headers={"ETag": etag})
 
 @app.post("/users", status_code=201)
 def create_user(user: User):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO users (name, email) VALUES (%s, %s) RETURNING id",
             (user.name, user.email)
@@ -103,58 +214,108 @@ def create_user(user: User):
         conn.commit()
         # Here you would also insert default rows into demographics, onboarding, and user_status.
         return {"id": user_id, "name": user.name, "email": user.email}
-    finally:
-        cur.close()
-        conn.close()
 
 @app.put("/users/{user_id}")
 def update_user(user_id: int, user: UserUpdate):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        # Update only provided fields (simplified update on users table)
-        if user.name:
-            cur.execute("UPDATE users SET name = %s WHERE id = %s", (user.name, user_id))
-        if user.email:
-            cur.execute("UPDATE users SET email = %s WHERE id = %s", (user.email, user_id))
+    with db.connection() as conn, conn.cursor() as cur:
+        # Update only provided fields, in a single statement
+        row = partial_update(cur, "users", user, {"id": user_id}, ("id", "name", "email"))
+        if not row:
+            raise HTTPException(status_code=404, detail="User not found")
         conn.commit()
-        return {"message": "User updated successfully"}
-    finally:
-        cur.close()
-        conn.close()
+        return {"id": row[0], "name": row[1], "email": row[2]}
 
 @app.delete("/users/{user_id}")
 def delete_user(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         # Logical deletion: update status to 'deleted' in user_status
         cur.execute("UPDATE user_status SET status = 'deleted' WHERE user_id = %s", (user_id,))
         conn.commit()
         return {"message": "User logically deleted"}
-    finally:
-        cur.close()
-        conn.close()
+
+# ---------- Aggregated user profile ----------
+
+PROFILE_SECTIONS = ("accounts", "credit_cards")
+# One round trip for the user and its nested sections. Sections that were not
+# requested are skipped by the CASE, so their subqueries never run.
+PROFILE_SQL = prepared("""
+    SELECT json_build_object(
+        'id', u.id,
+        'name', u.name,
+        'email', u.email,
+        'accounts', CASE WHEN %s THEN (
+            SELECT coalesce(json_agg(json_build_object(
+                'id', a.id, 'account_type', a.account_type, 'balance', a.balance::float8, 'currency', a.currency
+            ) ORDER BY a.id), '[]')
+            FROM accounts a WHERE a.user_id = u.id
+        ) END,
+        'credit_cards', CASE WHEN %s THEN (
+            SELECT coalesce(json_agg(json_build_object(
+                'id', ci.id, 'card_number', ci.card_number, 'expiration_date', ci.expiration_date, 'status', ci.status
+            ) ORDER BY ci.id), '[]')
+            FROM card_info ci JOIN accounts a ON a.id = ci.account_id WHERE a.user_id = u.id
+        ) END
+    )
+    FROM users u WHERE u.id = %s
+""")
+PROFILE_VERSION_SQL = prepared("""
+    SELECT md5(u.xmin::text
+        || '/' || coalesce((SELECT string_agg(a.id || ':' || a.xmin, ',' ORDER BY a.id)
+                            FROM accounts a WHERE a.user_id = u.id), '')
+        || '/' || coalesce((SELECT string_agg(ci.id || ':' || ci.xmin, ',' ORDER BY ci.id)
+                            FROM card_info ci JOIN accounts a ON a.id = ci.account_id WHERE a.user_id = u.id), ''))
+    FROM users u WHERE u.id = %s
+""")
+
+@app.get("/users/{user_id}/profile")
+@flight.coalesce
+def get_user_profile(
+    user_id: int,
+    include: str = Query(",".join(PROFILE_SECTIONS), description="Comma-separated sections: accounts, credit_cards"),
+    if_none_match: Optional[str] = Header(None),
+):
+    sections = {section.strip() for section in include.split(",") if section.strip()}
+    unknown = sections.difference(PROFILE_SECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail="Unknown profile sections: " + ", ".join(sorted(unknown)))
+    with replicas.connection() as conn, conn.cursor() as cur:
+        # Cheap version check first: a matching If-None-Match skips the JSON build.
+        cur.execute(PROFILE_VERSION_SQL, (user_id,))
+        version = cur.fetchone()
+        if not version:
+            raise HTTPException(status_code=404, detail="User not found")
+        etag = make_etag(version[0], "profile", tuple(sorted(sections)))
+        check_not_modified(if_none_match, etag)
+        cur.execute(PROFILE_SQL, ("accounts" in sections, "credit_cards" in sections, user_id))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="User not found")
+        profile = row[0]
+        for section in PROFILE_SECTIONS:
+            if section not in sections:
+                del profile[section]
+        return TimedJSONResponse(profile, headers={"ETag": etag})
 
 # ---------- Endpoints for Account Management ----------
 
+ACCOUNT_COLUMNS = ("id", "account_type", "balance", "currency")
+ACCOUNTS_VERSION_SQL = prepared("SELECT md5(string_agg(id || ':' || xmin, ',' ORDER BY id)) FROM accounts WHERE user_id = %s")
+ACCOUNTS_SQL = prepared("SELECT id, account_type, balance::float8, currency FROM accounts WHERE user_id = %s ORDER BY id")
+
 @app.get("/users/{user_id}/accounts")
-def get_accounts(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id, account_type, balance, currency FROM accounts WHERE user_id = %s", (user_id,))
-        accounts = cur.fetchall()
-        return [{"id": row[0], "account_type": row[1], "balance": float(row[2]), "currency": row[3]} for row in accounts]
-    finally:
-        cur.close()
-        conn.close()
+@flight.coalesce
+async def get_accounts(
+    user_id: int, accept: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)
+):
+    version = await replicas.fetch_all(ACCOUNTS_VERSION_SQL, (user_id,))
+    etag = make_etag(version[0][0], "accounts", negotiate(accept))
+    check_not_modified(if_none_match, etag, vary="Accept")
+    accounts = await replicas.fetch_all(ACCOUNTS_SQL, (user_id,))
+    return TimedRowsResponse(ACCOUNT_COLUMNS, accounts, accept, headers={"ETag": etag})
 
 @app.post("/users/{user_id}/accounts", status_code=201)
 def create_account(user_id: int, account: Account):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         cur.execute(
             "INSERT INTO accounts (user_id, account_type, balance, currency) VALUES (%s, %s, %s, %s) RETURNING id",
             (user_id, account.account_type, account.balance, account.currency)
@@ -162,59 +323,53 @@ def create_account(user_id: int, account: Account):
         account_id = cur.fetchone()[0]
         conn.commit()
         return {"id": account_id, **account.dict()}
-    finally:
-        cur.close()
-        conn.close()
 
 @app.put("/users/{user_id}/accounts/{account_id}")
 def update_account(user_id: int, account_id: int, account: AccountUpdate):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        if account.account_type:
-            cur.execute("UPDATE accounts SET account_type = %s WHERE id = %s AND user_id = %s", (account.account_type, account_id, user_id))
-        if account.balance is not None:
-            cur.execute("UPDATE accounts SET balance = %s WHERE id = %s AND user_id = %s", (account.balance, account_id, user_id))
-        if account.currency:
-            cur.execute("UPDATE accounts SET currency = %s WHERE id = %s AND user_id = %s", (account.currency, account_id, user_id))
+    with db.connection() as conn, conn.cursor() as cur:
+        row = partial_update(
+            cur, "accounts", account, {"id": account_id, "user_id": user_id},
+            ("id", "account_type", "balance", "currency")
+        )
+        if not row:
+            raise HTTPException(status_code=404, detail="Account not found")
         conn.commit()
-        return {"message": "Account updated successfully"}
-    finally:
-        cur.close()
-        conn.close()
+        return {"id": row[0], "account_type": row[1], "balance": float(row[2]), "currency": row[3]}
 
 @app.delete("/users/{user_id}/accounts/{account_id}")
 def delete_account(user_id: int, account_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         # Logical deletion: update a status field (assuming accounts has a status column)
         cur.execute("UPDATE accounts SET status = 'deleted' WHERE id = %s AND user_id = %s", (account_id, user_id))
         conn.commit()
         return {"message": "Account logically deleted"}
-    finally:
-        cur.close()
-        conn.close()
 
 # ---------- Endpoints for Credit Cards (using card_info) ----------
 
+CARDS_VERSION_SQL = prepared("""
+    SELECT md5(string_agg(id || ':' || xmin, ',' ORDER BY id)) FROM card_info
+    WHERE account_id IN (SELECT id FROM accounts WHERE user_id = %s)
+""")
+CARDS_SQL = prepared("""
+    SELECT id, card_number, expiration_date, status FROM card_info
+    WHERE account_id IN (SELECT id FROM accounts WHERE user_id = %s) ORDER BY id
+""")
+
 @app.get("/users/{user_id}/credit-cards")
-def get_credit_cards(user_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id, card_number, expiration_date, status FROM card_info WHERE account_id IN (SELECT id FROM accounts WHERE user_id = %s)", (user_id,))
-        cards = cur.fetchall()
-        return [{"id": row[0], "card_number": row[1], "expiration_date": str(row[2]), "status": row[3]} for row in cards]
-    finally:
-        cur.close()
-        conn.close()
+@flight.coalesce
+async def get_credit_cards(user_id: int, if_none_match: Optional[str] = Header(None)):
+    version = await replicas.fetch_all(CARDS_VERSION_SQL, (user_id,))
+    etag = make_etag(version[0][0], "credit_cards")
+    check_not_modified(if_none_match, etag)
+    cards = await replicas.fetch_all(CARDS_SQL, (user_id,))
+    return TimedJSONResponse(
+        [{"id": row[0], "card_number": row[1], "expiration_date": str(row[2]), "status": row[3]} for row in cards],
+        headers={"ETag": etag}
+    )
 
 @app.post("/users/{user_id}/credit-cards", status_code=201)
 def create_credit_card(user_id: int, card: CreditCard):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         # For simplicity, assume a user has a primary account and we get its id:
         cur.execute("SELECT id FROM accounts WHERE user_id = %s LIMIT 1", (user_id,))
         account = cur.fetchone()
@@ -228,55 +383,88 @@ def create_credit_card(user_id: int, card: CreditCard):
         card_id = cur.fetchone()[0]
         conn.commit()
         return {"id": card_id}
-    finally:
-        cur.close()
-        conn.close()
 
 @app.put("/users/{user_id}/credit-cards/{card_id}")
 def update_credit_card(user_id: int, card_id: int, card: CreditCardUpdate):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        if card.expiration_date:
-            cur.execute("UPDATE card_info SET expiration_date = %s WHERE id = %s", (card.expiration_date, card_id))
-        if card.status:
-            cur.execute("UPDATE card_info SET status = %s WHERE id = %s", (card.status, card_id))
+    with db.connection() as conn, conn.cursor() as cur:
+        # Scoped to the user's own accounts, so a card id alone cannot reach another user's card.
+        row = partial_update(
+            cur, "card_info", card, {"id": card_id}, ("id", "card_number", "expiration_date", "status"),
+            condition=("account_id IN (SELECT id FROM accounts WHERE user_id = %s)", (user_id,))
+        )
+        if not row:
+            raise HTTPException(status_code=404, detail="Credit card not found")
         conn.commit()
-        return {"message": "Credit card updated successfully"}
-    finally:
-        cur.close()
-        conn.close()
+        return {"id": row[0], "card_number": row[1], "expiration_date": str(row[2]), "status": row[3]}
 
 @app.delete("/users/{user_id}/credit-cards/{card_id}")
 def delete_credit_card(user_id: int, card_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
+    with db.connection() as conn, conn.cursor() as cur:
         # Logical deletion: update status to 'deleted'
         cur.execute("UPDATE card_info SET status = 'deleted' WHERE id = %s", (card_id,))
         conn.commit()
         return {"message": "Credit card logically deleted"}
-    finally:
-        cur.close()
-        conn.close()
-
-# # ---------- Endpoints for Wallet Management (NoSQL simulated) ----------
-
-# @app.get("/users/{user_id}/wallet")
-# def get_wallet(user_id: int):
-#     # Retrieve wallet data from the in-memory store
-#     wallet = wallet_store.get(user_id, [])
-#     return {"wallet": wallet}
-
-# @app.post("/users/{user_id}/wallet", status_code=201)
-# def add_wallet_item(user_id: int, item: WalletItem):
-#     wallet = wallet_store.get(user_id, [])
-#     wallet.append(item.dict())
-#     wallet_store[user_id] = wallet
-#     return {"message": "Wallet item added", "wallet": wallet}
-
-# @app.put("/users/{user_id}/wallet")
-# def update_wallet(user_id: int, items: List[WalletItem]):
-#     # Replace the current wallet data with the new list
-#     wallet_store[user_id] = [item.dict() for item in items]
-#     return {"message": "Wallet updated", "wallet": wallet_store[user_id]}
\ No newline at end of file
+
+# ---------- Endpoints for Wallet Management ----------
+
+def pack_wallet_items(items):
+    # Stored as [type, details] pairs, without the repeated field names.
+    return [[item.type, item.details] for item in items]
+
+def wallet_items(stored):
+    return [{"type": item_type, "details": details} for item_type, details in stored]
+
+@app.get("/users/{user_id}/wallet")
+def get_wallet(user_id: int, if_none_match: Optional[str] = Header(None)):
+    version, stored = wallet_store.lookup(str(user_id), [])
+    etag = make_etag(version, "wallet")
+    check_not_modified(if_none_match, etag)
+    return TimedJSONResponse({"wallet": wallet_items(stored)}, headers={"ETag": etag})
+
+@app.post("/users/{user_id}/wallet", status_code=201)
+def add_wallet_item(user_id: int, item: WalletItem):
+    # Read-modify-write under the store's file lock, so concurrent adds from
+    # other workers are not lost.
+    stored = wallet_store.update(str(user_id), lambda items: items + pack_wallet_items([item]), [])
+    return {"message": "Wallet item added", "wallet": wallet_items(stored)}
+
+@app.put("/users/{user_id}/wallet")
+def update_wallet(user_id: int, items: List[WalletItem]):
+    # Replace the current wallet data with the new list
+    stored = wallet_store.put(str(user_id), pack_wallet_items(items))
+    return {"message": "Wallet updated", "wallet": wallet_items(stored)}
+
+# ---------- Schema ----------
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# The hot read paths; `python main.py check-plans` fails if any of them needs
+# a sequential scan.
+PLAN_CHECKS = [
+    ("get_user", USER_SQL, (1,)),
+    ("get_users (version)", USERS_VERSION_SQL, ([1],)),
+    ("get_users", BATCH_USERS_SQL, ([1],)),
+    ("get_user_profile (version)", PROFILE_VERSION_SQL, (1,)),
+    ("get_user_profile", PROFILE_SQL, (True, True, 1)),
+    ("get_accounts (version)", ACCOUNTS_VERSION_SQL, (1,)),
+    ("get_accounts", ACCOUNTS_SQL, (1,)),
+    ("get_credit_cards (version)", CARDS_VERSION_SQL, (1,)),
+    ("get_credit_cards", CARDS_SQL, (1,)),
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance commands for api_users")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="Apply pending schema migrations")
+    commands.add_parser("check-plans", help="Fail if a hot query plans a sequential scan")
+    args = parser.parse_args()
+    status = 0
+    if args.command == "migrate":
+        conn = psycopg2.connect(**db.dsn)
+        try:
+            print("applied: %s" % (", ".join(migrate(conn, MIGRATIONS_DIR)) or "nothing"))
+        finally:
+            conn.close()
+    elif args.command == "check-plans":
+        status = run_plan_checks([(db, PLAN_CHECKS)])
+    db.close()
+    raise SystemExit(status)
@@ -0,0 +1,16 @@
+-- api_users/migrations/0001_initial.sql
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY, name TEXT NOT NULL, email TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_status (
+    user_id INTEGER PRIMARY KEY REFERENCES users (id), status TEXT NOT NULL DEFAULT 'active'
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id),
+    account_type TEXT NOT NULL, balance NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    currency TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'active'
+);
+CREATE TABLE IF NOT EXISTS card_info (
+    id SERIAL PRIMARY KEY, account_id INTEGER NOT NULL REFERENCES accounts (id),
+    card_number TEXT NOT NULL, expiration_date DATE NOT NULL, status TEXT NOT NULL DEFAULT 'active'
+);
@@ -0,0 +1,9 @@
+-- api_users/migrations/0002_hot_indexes.sql
+-- migrate: no-transaction
+-- Accounts of a user in id order (accounts list, profile, version checks),
+-- covering the columns the list returns.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_id_idx
+    ON accounts (user_id, id) INCLUDE (account_type, balance, currency);
+-- Cards of an account (credit-cards list, profile, version checks).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS card_info_account_id_idx
+    ON card_info (account_id, id) INCLUDE (card_number, expiration_date, status);
@@ -0,0 +1,281 @@
+# bench/run.py
+"""Replay a mixed workload against api_users, api_transactions and api_metas.
+
+By default the three services are started locally with uvicorn against the
+database given on the command line (seed it first with bench/seed.py). Pass
+--no-boot to target an already running stack such as docker-compose.
+
+The report is JSON with sorted keys so reports from two commits can be
+diffed directly, or compared with --baseline.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from seed import add_connection_args  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    "users": ("api_users", "core_users"),
+    "transactions": ("api_transactions", "core_transactions"),
+    "metas": ("api_metas", "ml_metas"),
+}
+
+# (weight, service, method, path template, body template). Weighted toward the
+# user history and campaign reads, which dominate production traffic.
+DEFAULT_MIX = [
+    (30, "transactions", "GET", "/users/{user}/transactions", None),
+    (20, "metas", "GET", "/users/{user}/campaigns", None),
+    (15, "metas", "GET", "/campaigns/{campaign}", None),
+    (10, "users", "GET", "/users/{user}", None),
+    (8, "users", "GET", "/users/{user}/accounts", None),
+    (5, "users", "GET", "/users/{user}/credit-cards", None),
+    (4, "users", "GET", "/users/{user}/profile", None),
+    (3, "transactions", "GET", "/transactions/{transaction}", None),
+    (3, "transactions", "POST", "/transactions",
+     {"user_id": "{user}", "amount": 12.5, "merchant": "bench", "account_type": "debit"}),
+    (2, "transactions", "GET", "/users/{user}/operations", None),
+]
+
+
+def fill(template, values):
+    if isinstance(template, dict):
+        return {key: fill(value, values) for key, value in template.items()}
+    if isinstance(template, str) and template.startswith("{") and template.endswith("}"):
+        return values[template[1:-1]]
+    return template
+
+
+def generated_workload(count, seed, users, campaigns, transactions):
+    rng = random.Random(seed)
+    weights = [entry[0] for entry in DEFAULT_MIX]
+    for _ in range(count):
+        _, service, method, path, body = rng.choices(DEFAULT_MIX, weights)[0]
+        values = {
+            "user": rng.randint(1, users),
+            "campaign": rng.randint(1, campaigns),
+            "transaction": rng.randint(1, transactions),
+        }
+        yield {
+            "service": service,
+            "method": method,
+            "path": path.format(**values),
+            "route": path,
+            "body": fill(body, values),
+        }
+
+
+def file_workload(path):
+    # One JSON object per line: {"service", "method", "path", "body"?, "route"?}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault("route", item["path"])
+                yield item
+
+
+class Worker(threading.Thread):
+    def __init__(self, urls, next_request, results, deadline):
+        super().__init__(daemon=True)
+        self.urls = urls
+        self.next_request = next_request
+        self.results = results
+        self.deadline = deadline
+        self.connections = {}
+
+    def connection(self, service):
+        conn = self.connections.get(service)
+        if conn is None:
+            url = urlsplit(self.urls[service])
+            conn = self.connections[service] = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        return conn
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            item = self.next_request()
+            if item is None:
+                return
+            body = None if item.get("body") is None else json.dumps(item["body"])
+            headers = {"Content-Type": "application/json"} if body else {}
+            start = time.perf_counter()
+            try:
+                conn = self.connection(item["service"])
+                conn.request(item["method"], item["path"], body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                self.connections.pop(item["service"], None)
+                status = 0
+            self.results.append((item["method"] + " " + item["route"], time.perf_counter() - start, status))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 3)
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(latency for _, latency, _ in samples)
+    errors = sum(1 for _, _, status in samples if status == 0 or status >= 500)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "status": {str(code): sum(1 for s in samples if s[2] == code) for code in sorted({s[2] for s in samples})},
+        "rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+
+def run_load(urls, workload, concurrency, duration):
+    results = []
+    requests = iter(workload)
+    lock = threading.Lock()
+
+    def next_request():
+        # A generator cannot be resumed from two threads at once, so workers
+        # take items from the plain iterator under the lock; None when done.
+        with lock:
+            return next(requests, None)
+
+    deadline = time.monotonic() + duration
+    workers = [Worker(urls, next_request, results, deadline) for _ in range(concurrency)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results, time.monotonic() - start
+
+
+def boot_services(args):
+    processes = {}
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_HOST=args.host, DATABASE_PORT=str(args.port),
+               DATABASE_USER=args.user, DATABASE_PASSWORD=args.password)
+    for offset, (name, (directory, dbname)) in enumerate(SERVICES.items()):
+        port = args.base_port + offset
+        processes[name] = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(args.workers),
+             "--log-level", "warning"],
+            cwd=os.path.join(ROOT, directory), env=dict(env, DATABASE_NAME=dbname),
+        )
+    urls = {name: "http://127.0.0.1:%d" % (args.base_port + offset) for offset, name in enumerate(SERVICES)}
+    wait_ready(urls)
+    return processes, urls
+
+
+def wait_ready(urls, timeout=30):
+    deadline = time.monotonic() + timeout
+    for url in urls.values():
+        parts = urlsplit(url)
+        while True:
+            try:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=1)
+                conn.request("GET", "/stats/pool")
+                conn.getresponse().read()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("%s did not come up" % url)
+                time.sleep(0.2)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    for route, current in sorted(report["routes"].items()):
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            continue
+        print("%-45s p50 %8.2f -> %8.2f   p99 %8.2f -> %8.2f   rps %8.1f -> %8.1f" % (
+            route, before["p50_ms"], current["p50_ms"], before["p99_ms"], current["p99_ms"],
+            before["rps"], current["rps"]), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_connection_args(parser)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30, help="seconds, after warmup")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--requests", type=int, default=1000000, help="upper bound on generated requests")
+    parser.add_argument("--workload", help="JSONL file to replay instead of the generated mix")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=10000, help="id range used by the generated mix")
+    parser.add_argument("--campaigns", type=int, default=200)
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per service")
+    parser.add_argument("--base-port", type=int, default=18001)
+    parser.add_argument("--no-boot", action="store_true", help="use --users-url/--transactions-url/--metas-url")
+    parser.add_argument("--users-url", default="http://127.0.0.1:8001")
+    parser.add_argument("--transactions-url", default="http://127.0.0.1:8002")
+    parser.add_argument("--metas-url", default="http://127.0.0.1:8003")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    def workload():
+        if args.workload:
+            return file_workload(args.workload)
+        return generated_workload(args.requests, args.seed, args.users, args.campaigns, args.transactions)
+
+    processes = {}
+    if args.no_boot:
+        urls = {"users": args.users_url, "transactions": args.transactions_url, "metas": args.metas_url}
+    else:
+        processes, urls = boot_services(args)
+    try:
+        if args.warmup:
+            run_load(urls, workload(), args.concurrency, args.warmup)
+        samples, elapsed = run_load(urls, workload(), args.concurrency, args.duration)
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.wait()
+
+    by_route = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+    report = {
+        "revision": git_revision(),
+        "config": {
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "workers": args.workers,
+            "workload": args.workload or "generated",
+            "seed": args.seed,
+        },
+        "total": summarize(samples, elapsed),
+        "routes": {route: summarize(route_samples, elapsed) for route, route_samples in by_route.items()},
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
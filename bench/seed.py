@@ -0,0 +1,129 @@
+# bench/seed.py
+"""Create and seed the three databases used by the benchmark.
+
+Data is generated server-side with generate_series, so seeding a few hundred
+thousand rows takes seconds. The seed is fixed, so two runs against the same
+sizes produce the same data.
+"""
+import argparse
+import os
+import sys
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common.migrate import migrate  # noqa: E402
+
+# Each database gets its service's migrations, the same as in production.
+MIGRATIONS = {
+    "core_users": os.path.join(ROOT, "api_users", "migrations"),
+    "core_transactions": os.path.join(ROOT, "api_transactions", "migrations"),
+    "ml_metas": os.path.join(ROOT, "api_metas", "migrations"),
+}
+
+SEEDS = {
+    "core_users": """
+        TRUNCATE card_info, accounts, user_status, users RESTART IDENTITY CASCADE;
+        INSERT INTO users (name, email)
+            SELECT 'user ' || i, 'user' || i || '@example.com' FROM generate_series(1, %(users)s) i;
+        INSERT INTO user_status (user_id) SELECT id FROM users;
+        INSERT INTO accounts (user_id, account_type, balance, currency)
+            SELECT u.id, t.account_type, round((random() * 10000)::numeric, 2), 'PEN'
+            FROM users u CROSS JOIN (VALUES ('savings'), ('checking')) t (account_type);
+        INSERT INTO card_info (account_id, card_number, expiration_date)
+            SELECT id, lpad(id::text, 16, '4'), current_date + (random() * 1500)::int FROM accounts;
+    """,
+    "core_transactions": """
+        TRUNCATE transactions_mastercard, transactions_paypal, transactions_internal, operations,
+                 transaction_summaries RESTART IDENTITY;
+        INSERT INTO transactions_mastercard (user_id, amount, merchant, account_type, created_at)
+            SELECT 1 + (random() * (%(users)s - 1))::int, round((random() * 500)::numeric, 2),
+                   'merchant ' || (random() * 50)::int, (ARRAY['debit', 'credit'])[1 + (i %% 2)],
+                   now() - random() * interval '365 days'
+            FROM generate_series(1, %(users)s * %(transactions)s / 2) i;
+        INSERT INTO transactions_paypal (user_id, amount, merchant, account_type, created_at)
+            SELECT 1 + (random() * (%(users)s - 1))::int, round((random() * 500)::numeric, 2),
+                   'merchant ' || (random() * 50)::int, 'debit', now() - random() * interval '365 days'
+            FROM generate_series(1, %(users)s * %(transactions)s / 4) i;
+        INSERT INTO transactions_internal (sender_id, receiver_id, amount, account_type, created_at)
+            SELECT 1 + (random() * (%(users)s - 1))::int, 1 + (random() * (%(users)s - 1))::int,
+                   round((random() * 500)::numeric, 2), 'savings', now() - random() * interval '365 days'
+            FROM generate_series(1, %(users)s * %(transactions)s / 4) i;
+        INSERT INTO operations (user_id, description)
+            SELECT 1 + (random() * (%(users)s - 1))::int, 'operation ' || i
+            FROM generate_series(1, %(users)s * 2) i;
+        INSERT INTO transaction_summaries (user_id, source, merchant, account_type, count, total)
+            SELECT user_id, source, merchant, account_type, count(*), sum(amount) FROM (
+                SELECT user_id, 'mastercard' AS source, COALESCE(merchant, '') AS merchant, account_type, amount
+                FROM transactions_mastercard
+                UNION ALL
+                SELECT user_id, 'paypal', COALESCE(merchant, ''), account_type, amount FROM transactions_paypal
+                UNION ALL
+                SELECT sender_id, 'internal', '', account_type, amount FROM transactions_internal
+            ) t
+            GROUP BY user_id, source, merchant, account_type;
+    """,
+    "ml_metas": """
+        TRUNCATE campaign_progress, user_campaigns, campaigns RESTART IDENTITY CASCADE;
+        INSERT INTO campaigns (name, goal, cashback_percentage, start_date, end_date)
+            SELECT 'campaign ' || i, 500 + (random() * 5000)::int, 1 + (random() * 9)::int,
+                   current_date - (random() * 180)::int, current_date + (random() * 180)::int
+            FROM generate_series(1, %(campaigns)s) i;
+        INSERT INTO user_campaigns (user_id, campaign_id)
+            SELECT DISTINCT u, 1 + (random() * (%(campaigns)s - 1))::int
+            FROM generate_series(1, %(users)s) u, generate_series(1, 3) k;
+    """,
+}
+
+
+def connect(args, dbname):
+    return psycopg2.connect(host=args.host, port=args.port, user=args.user, password=args.password, dbname=dbname)
+
+
+def create_databases(args):
+    conn = connect(args, "postgres")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for dbname in MIGRATIONS:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (dbname,))
+            if not cur.fetchone():
+                cur.execute("CREATE DATABASE %s" % dbname)
+    conn.close()
+
+
+def seed(args):
+    create_databases(args)
+    sizes = {"users": args.users, "transactions": args.transactions_per_user, "campaigns": args.campaigns}
+    for dbname, directory in MIGRATIONS.items():
+        conn = connect(args, dbname)
+        migrate(conn, directory)
+        conn.close()
+        conn = connect(args, dbname)
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT setseed(%s)", (args.seed,))
+            cur.execute(SEEDS[dbname], sizes)
+            cur.execute("ANALYZE")
+        conn.close()
+        print("seeded %s" % dbname)
+
+
+def add_connection_args(parser):
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="postgres")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_connection_args(parser)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--transactions-per-user", type=int, default=40)
+    parser.add_argument("--campaigns", type=int, default=200)
+    parser.add_argument("--seed", type=float, default=0.42)
+    seed(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# common/__init__.py
+# Code shared by api_users, api_transactions, api_metas and the gateway.
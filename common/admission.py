@@ -0,0 +1,285 @@
+# common/admission.py
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from urllib.parse import parse_qs
+
+from common.encoding import dumps_json
+
+# Per-process admission control in front of every handler. ADMISSION_CONTROL=0
+# turns it off.
+ADMISSION_ENABLED = os.getenv("ADMISSION_CONTROL", "1").lower() in ("1", "true", "yes")
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "20"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "200"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+# How long a normal-priority request may wait for a slot; writes get 4x, bulk half.
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "500")) / 1000
+# The limit shrinks once latency exceeds the no-load latency by this factor.
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2"))
+
+# Priority classes, most important first. Lower classes may only use part of
+# the limit, so a burst of reads or bulk work leaves room for writes.
+CRITICAL, NORMAL, BULK = 0, 1, 2
+PRIORITY_NAMES = ("critical", "normal", "bulk")
+PRIORITY_SHARE = (1.0, 0.9, 0.5)
+PRIORITY_QUEUE_TIMEOUT = (4.0, 1.0, 0.5)
+
+EXEMPT_PATHS = ("/metrics", "/stats/", "/docs", "/openapi.json")
+
+
+def default_priority(scope):
+    # None skips admission control: metrics and stats must answer under load.
+    if scope["path"].startswith(EXEMPT_PATHS):
+        return None
+    if scope["method"] in ("GET", "HEAD", "OPTIONS"):
+        return NORMAL
+    return CRITICAL
+
+
+def query_flag(scope, name):
+    # Boolean query parameter as FastAPI would parse it, for classify functions.
+    values = parse_qs(scope["query_string"].decode("latin-1")).get(name)
+    return bool(values) and values[-1].lower() in ("1", "true", "on", "yes")
+
+
+class Rejected(Exception):
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdaptiveLimit:
+    """Concurrency limit driven by latency, in the spirit of TCP Vegas.
+
+    Latency is averaged over windows of completed requests and compared with
+    the lowest window average seen, which ages by 1% per second so that the
+    baseline follows lasting changes in the workload. Within ``tolerance`` times
+    the baseline the limit grows by about sqrt(limit) per window; beyond it
+    requests are queueing inside the service (in the pool, in Postgres) and
+    the limit shrinks in proportion. A 503 from the handler itself, such as
+    a pool timeout, cuts the limit by 10% right away.
+    """
+
+    def __init__(self, initial=None, min_limit=None, max_limit=None, tolerance=None):
+        self.value = float(ADMISSION_INITIAL_LIMIT if initial is None else initial)
+        self.min_limit = ADMISSION_MIN_LIMIT if min_limit is None else min_limit
+        self.max_limit = ADMISSION_MAX_LIMIT if max_limit is None else max_limit
+        self.tolerance = ADMISSION_LATENCY_TOLERANCE if tolerance is None else tolerance
+        self.min_latency = None
+        self._window_end = time.monotonic()
+        self._sum = 0.0
+        self._count = 0
+        self._max_in_flight = 0
+
+    def _clamp(self, value):
+        return min(max(value, self.min_limit), self.max_limit)
+
+    def on_sample(self, latency, in_flight):
+        self._sum += latency
+        self._count += 1
+        self._max_in_flight = max(self._max_in_flight, in_flight)
+        if self._count < max(10, int(self.value)):
+            return
+        sample = self._sum / self._count
+        max_in_flight = self._max_in_flight
+        self._sum, self._count, self._max_in_flight = 0.0, 0, 0
+        now = time.monotonic()
+        if self.min_latency is None or sample < self.min_latency:
+            self.min_latency = sample
+        else:
+            self.min_latency *= 1 + 0.01 * (now - self._window_end)
+        self._window_end = now
+        ratio = self.tolerance * self.min_latency / sample
+        # A service that never used half its limit says nothing about a higher one.
+        if ratio >= 1 and max_in_flight < self.value / 2:
+            return
+        gradient = max(0.5, min(1.0, ratio))
+        target = self.value * gradient + (math.sqrt(self.value) if ratio >= 1 else 0)
+        self.value = self._clamp(0.8 * self.value + 0.2 * target)
+
+    def on_drop(self):
+        self.value = self._clamp(self.value * 0.9)
+
+
+class AdmissionController:
+    """Bounds in-flight requests and sheds excess work early.
+
+    Requests under the current limit run immediately. Others wait in a
+    priority queue and are admitted, highest priority first, as slots free
+    up. A request is turned away with 429 when the queue is full (a waiting
+    request of lower priority is evicted in its place when there is one) and
+    with 503 when it would wait longer than its class allows, judged up front
+    from the recent service time or on expiry. Both carry Retry-After.
+    """
+
+    def __init__(self, limit=None, max_queue=None, queue_timeout=None, enabled=None):
+        self.enabled = ADMISSION_ENABLED if enabled is None else enabled
+        self.limit = limit or AdaptiveLimit()
+        self.max_queue = ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout = ADMISSION_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.in_flight = 0
+        self.service_time = None  # moving average, seconds
+        self._waiters = []  # heap of [priority, seq, future, timer]
+        self._seq = itertools.count()
+        self._stats = {
+            "admitted": 0,
+            "queued": 0,
+            "queue_wait_seconds_total": 0.0,
+            "rejected_queue_full": 0,
+            "rejected_queue_timeout": 0,
+            "rejected_early": 0,
+            "handler_503": 0,
+        }
+        for name in PRIORITY_NAMES:
+            self._stats["rejected_" + name] = 0
+
+    def _capacity(self, priority):
+        return self.limit.value * PRIORITY_SHARE[priority]
+
+    def _expected_wait(self, position):
+        # Requests ahead of us leave at roughly limit per service time.
+        if self.service_time is None:
+            return 0.0
+        return position * self.service_time / max(self.limit.value, 1)
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._expected_wait(len(self._waiters) + 1)))
+
+    def _reject(self, priority, status_code, detail, reason):
+        self._stats[reason] += 1
+        self._stats["rejected_" + PRIORITY_NAMES[priority]] += 1
+        return Rejected(status_code, detail, self._retry_after())
+
+    async def acquire(self, priority):
+        # Returns the admission time, to be passed back to release().
+        queue_ahead = self._waiters and self._waiters[0][0] <= priority
+        if not queue_ahead and self.in_flight < self._capacity(priority):
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            return time.monotonic()
+        timeout = self.queue_timeout * PRIORITY_QUEUE_TIMEOUT[priority]
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+        if self._expected_wait(ahead + 1) > timeout:
+            raise self._reject(priority, 503, "Service overloaded", "rejected_early")
+        if len(self._waiters) >= self.max_queue:
+            worst = max(self._waiters) if self._waiters else None
+            if worst is None or worst[0] <= priority:
+                raise self._reject(priority, 429, "Too many requests", "rejected_queue_full")
+            self._remove(worst)
+            worst[3].cancel()
+            worst[2].set_exception(self._reject(worst[0], 429, "Too many requests", "rejected_queue_full"))
+
+        loop = asyncio.get_running_loop()
+        waiter = [priority, next(self._seq), loop.create_future(), None]
+        waiter[3] = loop.call_later(timeout, self._expire, waiter)
+        heapq.heappush(self._waiters, waiter)
+        self._stats["queued"] += 1
+        queued_at = time.monotonic()
+        try:
+            await waiter[2]
+        except asyncio.CancelledError:
+            # The client went away: give back the slot if we already got one.
+            if waiter[2].done() and not waiter[2].cancelled() and waiter[2].exception() is None:
+                self.release(queued_at, 200, sample=False)
+            else:
+                waiter[3].cancel()
+                self._remove(waiter)
+            raise
+        admitted_at = time.monotonic()
+        self._stats["queue_wait_seconds_total"] += admitted_at - queued_at
+        return admitted_at
+
+    def _remove(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+
+    def _expire(self, waiter):
+        if not waiter[2].done():
+            self._remove(waiter)
+            waiter[2].set_exception(self._reject(waiter[0], 503, "Service overloaded", "rejected_queue_timeout"))
+
+    def release(self, admitted_at, status_code, sample=True):
+        self.in_flight -= 1
+        if sample:
+            latency = time.monotonic() - admitted_at
+            self.service_time = latency if self.service_time is None else 0.9 * self.service_time + 0.1 * latency
+            if status_code == 503:
+                self._stats["handler_503"] += 1
+                self.limit.on_drop()
+            else:
+                self.limit.on_sample(latency, self.in_flight + 1)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self._capacity(self._waiters[0][0]):
+            _, _, future, timer = heapq.heappop(self._waiters)
+            timer.cancel()
+            if not future.done():
+                self.in_flight += 1
+                self._stats["admitted"] += 1
+                future.set_result(None)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "limit": round(self.limit.value, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "service_time_ms": round(self.service_time * 1000, 3) if self.service_time is not None else 0,
+            **self._stats,
+        }
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware running every request through an AdmissionController.
+
+    ``classify(scope)`` maps a request to CRITICAL, NORMAL or BULK, or to
+    None to bypass admission control (see default_priority).
+    """
+
+    def __init__(self, app, controller, classify=default_priority):
+        self.app = app
+        self.controller = controller
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+        priority = self.classify(scope)
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            admitted_at = await self.controller.acquire(priority)
+        except Rejected as e:
+            body = dumps_json({"detail": e.detail})
+            await send({
+                "type": "http.response.start",
+                "status": e.status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(e.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.controller.release(admitted_at, status[0])
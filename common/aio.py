@@ -0,0 +1,127 @@
+# common/aio.py
+import asyncio
+import itertools
+import os
+import re
+import time
+from functools import lru_cache
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from common.db import POOL_MAX, POOL_MIN, POOL_TIMEOUT
+from common.metrics import record_timing
+from common.tracing import tracer
+
+try:
+    import asyncpg
+except ImportError:  # async mode is opt-in, the sync path only needs psycopg2
+    asyncpg = None
+
+# What opening a pool raises when the server is down or refuses us.
+CONNECT_ERRORS = (OSError, asyncio.TimeoutError)
+if asyncpg is not None:
+    CONNECT_ERRORS += (asyncpg.PostgresError, asyncpg.InterfaceError)
+
+# Opt-in: when enabled, the async handlers talk to Postgres through asyncpg on
+# the event loop instead of borrowing a worker thread for each request.
+ASYNC_ENABLED = os.getenv("DATABASE_ASYNC", "0").lower() in ("1", "true", "yes")
+
+_PLACEHOLDER = re.compile(r"%s")
+
+
+@lru_cache(maxsize=256)
+def to_asyncpg(sql):
+    # psycopg2 uses %s placeholders, asyncpg wants $1, $2, ...
+    counter = itertools.count(1)
+    return _PLACEHOLDER.sub(lambda _: "$%d" % next(counter), sql)
+
+
+class AsyncDatabase:
+    """Non-blocking query path used by the ``async def`` handlers.
+
+    With ``DATABASE_ASYNC`` enabled queries run on an asyncpg pool sized like
+    the sync one. Otherwise they fall back to the psycopg2 ``ConnectionPool``
+    in Starlette's threadpool, which is what a plain ``def`` handler does.
+    """
+
+    def __init__(self, pool, host, port, dbname, user, password, enabled=None):
+        self.pool = pool
+        self.enabled = ASYNC_ENABLED if enabled is None else enabled
+        if self.enabled and asyncpg is None:
+            raise RuntimeError("DATABASE_ASYNC is enabled but asyncpg is not installed")
+        self.dsn = {"host": host, "port": int(port), "database": dbname, "user": user, "password": password}
+        self._apool = None
+
+    async def open(self):
+        if not self.enabled or self._apool is not None:
+            return
+        self._apool = await asyncpg.create_pool(
+            min_size=min(POOL_MIN, POOL_MAX), max_size=POOL_MAX, **self.dsn
+        )
+
+    async def close(self):
+        if self._apool is not None:
+            await self._apool.close()
+            self._apool = None
+
+    async def fetch_all(self, sql, params=()):
+        if not self.enabled:
+            return await run_in_threadpool(self._fetch_all_sync, sql, params)
+        try:
+            if self._apool is None:
+                try:
+                    await self.open()
+                except CONNECT_ERRORS:
+                    raise HTTPException(status_code=500, detail="Database connection error")
+            async with self._apool.acquire(timeout=POOL_TIMEOUT) as conn:
+                start = time.perf_counter()
+                try:
+                    rows = await conn.fetch(to_asyncpg(sql), *params)
+                except Exception as e:
+                    self._finish(sql, params, start, error=e)
+                    raise
+                record = self._finish(sql, params, start)
+                if record is not None:
+                    await self._explain(conn, sql, params, record)
+                return rows
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Database pool exhausted")
+        except (OSError, asyncpg.exceptions.ConnectionDoesNotExistError):
+            raise HTTPException(status_code=500, detail="Database connection error")
+
+    def _finish(self, sql, params, start, error=None):
+        # Same accounting as TimedCursor in common/db.py.
+        elapsed = time.perf_counter() - start
+        record_timing("db_query", elapsed)
+        if not tracer.is_slow(elapsed):
+            return None
+        return tracer.trace(sql, params, elapsed, error=error)
+
+    async def _explain(self, conn, sql, params, record):
+        # fetch() runs outside a transaction here, so a failed EXPLAIN is harmless.
+        try:
+            rows = await conn.fetch("EXPLAIN (ANALYZE, BUFFERS) " + to_asyncpg(sql), *params)
+        except Exception as e:
+            tracer.add_plan(record, error=e)
+            return
+        tracer.add_plan(record, "\n".join(row[0] for row in rows))
+
+    def _fetch_all_sync(self, sql, params):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def stats(self):
+        if self._apool is None:
+            return {"enabled": self.enabled}
+        size = self._apool.get_size()
+        idle = self._apool.get_idle_size()
+        return {
+            "enabled": True,
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "min": self._apool.get_min_size(),
+            "max": self._apool.get_max_size(),
+        }
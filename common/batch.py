@@ -0,0 +1,25 @@
+# common/batch.py
+import os
+
+from fastapi import HTTPException
+
+BATCH_GET_MAX_IDS = int(os.getenv("BATCH_GET_MAX_IDS", "1000"))
+
+
+def parse_ids(ids, max_ids=None):
+    # "1,2,3" -> [1, 2, 3], keeping the caller's order and duplicates.
+    max_ids = BATCH_GET_MAX_IDS if max_ids is None else max_ids
+    try:
+        parsed = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids must not be empty")
+    if len(parsed) > max_ids:
+        raise HTTPException(status_code=400, detail="At most %d ids per request" % max_ids)
+    return parsed
+
+
+def in_request_order(ids, found):
+    # One entry per requested id; missing ids get an explicit marker.
+    return [found[item_id] if item_id in found else {"id": item_id, "error": "Not found"} for item_id in ids]
@@ -0,0 +1,266 @@
+# common/cache.py
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+MISSING = object()
+# Every process' TTLCaches hear about invalidations on this channel.
+INVALIDATION_CHANNEL = "cache:invalidate"
+INVALIDATION_RETRY_SECONDS = 1.0
+
+logger = logging.getLogger("cache")
+
+
+class LocalBackend:
+    """In-process stand-in for a shared cache server.
+
+    Exposes the same calls as ``RedisBackend`` and stores the same
+    serialized bytes, so it can replace it in development and in tests. It
+    lives in one process, so invalidations need no broadcast.
+    """
+
+    errors = ()
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        pass
+
+    def subscribe(self, callback):
+        pass
+
+    def listening(self):
+        return True
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+
+class RedisBackend:
+    """Shared second level, plus the channel that keeps first levels coherent.
+
+    Invalidations are published on INVALIDATION_CHANNEL, and a background
+    thread per process hands them to the subscribed caches. While that
+    subscription is down, ``listening()`` is false and the caches skip their
+    local level, since they could miss invalidations.
+    """
+
+    def __init__(self, url):
+        import redis  # optional dependency, only needed for a shared backend
+        self.errors = (redis.RedisError,)
+        self._client = redis.Redis.from_url(url, socket_timeout=0.05)
+        # The subscriber blocks between messages, so it gets no short timeout.
+        self._subscriber = redis.Redis.from_url(url, health_check_interval=30)
+        self._callbacks = []
+        self._listening = threading.Event()
+        self._thread = None
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, px=int(ttl * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*keys)
+
+    def publish(self, message):
+        self._client.publish(INVALIDATION_CHANNEL, message)
+
+    def subscribe(self, callback):
+        # callback(message) for every invalidation, from any process, and
+        # callback(None) after each (re)subscription, as messages may have
+        # been missed in between.
+        self._callbacks.append(callback)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="cache-invalidations", daemon=True)
+            self._thread.start()
+
+    def listening(self):
+        return self._listening.is_set()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._subscriber.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                self._listening.set()
+                for callback in self._callbacks:
+                    callback(None)
+                for message in pubsub.listen():
+                    for callback in self._callbacks:
+                        callback(message["data"])
+            except self.errors as e:
+                logger.warning("cache invalidation channel down: %s", e)
+            self._listening.clear()
+            time.sleep(INVALIDATION_RETRY_SECONDS)
+
+
+def backend_from_env():
+    # CACHE_BACKEND_URL=redis://host:6379/0 shares entries between workers and
+    # replicas; "local://" selects the in-process stand-in.
+    url = os.getenv("CACHE_BACKEND_URL")
+    if not url:
+        return None
+    if url == "local://":
+        return LocalBackend()
+    return RedisBackend(url)
+
+
+class TTLCache:
+    """Bounded in-process cache with per-entry TTL and LRU eviction.
+
+    When a shared ``backend`` is configured it acts as a second level: local
+    misses are looked up there and writes and invalidations go to both.
+    Invalidations are also broadcast to the other processes' local levels.
+    Backend errors count as misses (or are ignored for writes), so the cache
+    stays optional: callers fall through to the database. Async handlers use
+    ``call`` to keep the backend's network calls off the event loop.
+    """
+
+    def __init__(self, name, maxsize=10000, ttl=300.0, backend=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "shared_hits": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "backend_errors": 0,
+        }
+        if backend is not None:
+            backend.subscribe(self._on_invalidation)
+
+    def _local(self):
+        # Local entries are only trusted while invalidations are being received.
+        return self.backend is None or self.backend.listening()
+
+    def _backend_error(self, e):
+        with self._lock:
+            self._stats["backend_errors"] += 1
+        logger.warning("cache backend error (%s): %s", self.name, e)
+
+    def _shared_key(self, key):
+        return "%s:%s" % (self.name, key)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key) if self._local() else None
+            if entry is not None:
+                if entry[1] > now:
+                    self._data.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[0]
+                del self._data[key]
+                self._stats["expirations"] += 1
+        if self.backend is not None:
+            try:
+                raw = self.backend.get(self._shared_key(key))
+            except self.backend.errors as e:
+                self._backend_error(e)
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._store(key, value)
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+                return value
+        with self._lock:
+            self._stats["misses"] += 1
+        return MISSING
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not MISSING:
+                found[key] = value
+        return found
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            try:
+                self.backend.set(self._shared_key(key), json.dumps(value), self.ttl)
+            except self.backend.errors as e:
+                self._backend_error(e)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *keys):
+        self._drop(keys)
+        with self._lock:
+            self._stats["invalidations"] += len(keys)
+        if self.backend is not None:
+            try:
+                self.backend.delete(*(self._shared_key(key) for key in keys))
+                self.backend.publish(json.dumps([self.name, list(keys)]))
+            except self.backend.errors as e:
+                # Other processes may keep the old entry until its TTL.
+                self._backend_error(e)
+
+    def _drop(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def _on_invalidation(self, message):
+        if message is None:
+            self.clear()
+            return
+        name, keys = json.loads(message)
+        if name == self.name:
+            self._drop(keys)
+
+    async def call(self, fn, *args):
+        # Runs a cache call from async code: in the threadpool when a shared
+        # backend may block on the network, inline otherwise.
+        if self.backend is None:
+            return fn(*args)
+        return await run_in_threadpool(fn, *args)
+
+    def clear(self):
+        with self._lock:
+            self._stats["invalidations"] += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl, **self._stats}
@@ -0,0 +1,335 @@
+# common/db.py
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from fastapi import HTTPException
+
+from common.metrics import record_timing
+from common.prepared import count, fits_prepared, mark_unpreparable, should_prepare
+from common.tracing import tracer
+
+# Pool sizing and behaviour, shared by the three services. Every value can be
+# overridden per container through the environment (see docker-compose.yml).
+POOL_MIN = int(os.getenv("DATABASE_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DATABASE_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "5"))
+# Idle connections older than this (seconds) are pinged before being handed out.
+POOL_HEALTHCHECK_IDLE = float(os.getenv("DATABASE_POOL_HEALTHCHECK_IDLE", "30"))
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    # Feeds the per-request db_query breakdown in common/metrics.py and the
+    # slow query log in common/tracing.py.
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            if self.name is None and should_prepare(query):
+                result = self._execute_prepared(query, vars)
+            else:
+                result = super().execute(query, vars)
+        except Exception as e:
+            self._finish(query, vars, start, error=e)
+            raise
+        # A named (server-side) cursor has only declared itself: nothing to explain.
+        record = self._finish(query, vars, start, explain=self.name is None)
+        if record is not None:
+            self._explain(query, vars, record)
+        return result
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception as e:
+            self._finish(query, None, start, error=e)
+            raise
+        self._finish(query, None, start, explain=False)
+        return result
+
+    def _execute_prepared(self, query, vars, retry=True):
+        # PREPAREs the statement the first time this connection runs it, then
+        # only sends EXECUTE with the parameters.
+        conn = self.connection
+        registry = getattr(conn, "prepared", None)
+        if registry is None:  # a connection from plain psycopg2.connect()
+            return super().execute(query, vars)
+        args = query.arguments(vars)
+        if not fits_prepared(args):
+            return super().execute(query, vars)
+        fresh = conn.autocommit or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        state = registry.get(query.name)
+        if state is True:
+            count("hits")
+        elif not self._prepare(query, args, deallocate=state is False):
+            return super().execute(query, vars)
+        count("executes")
+        try:
+            return super().execute(query.execute_sql, args)
+        except (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName) as e:
+            # A schema change altered the result columns ("cached plan must not
+            # change result type"), or the session lost its statements, e.g.
+            # to DISCARD ALL. Prepare again; retry if nothing else ran in the
+            # transaction that just aborted.
+            if isinstance(e, psycopg2.errors.FeatureNotSupported):
+                if "cached plan" not in str(e):
+                    raise
+                registry[query.name] = False
+            else:
+                registry.pop(query.name, None)
+            count("invalidations")
+            if not (retry and fresh):
+                raise
+            conn.rollback()
+            count("retries")
+            return self._execute_prepared(query, vars, retry=False)
+
+    def _prepare(self, query, args, deallocate=False):
+        # A failed PREPARE would abort the caller's transaction: guard it
+        # with a savepoint, or roll back the transaction it opened itself.
+        conn = self.connection
+        savepoint = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            if savepoint:
+                cur.execute("SAVEPOINT prepare_statement")
+            try:
+                if deallocate:
+                    cur.execute("DEALLOCATE %s" % query.name)
+                cur.execute(query.prepare_sql(args))
+            except psycopg2.ProgrammingError as e:
+                if savepoint:
+                    cur.execute("ROLLBACK TO SAVEPOINT prepare_statement")
+                    cur.execute("RELEASE SAVEPOINT prepare_statement")
+                elif not conn.autocommit:
+                    conn.rollback()
+                conn.prepared.pop(query.name, None)
+                # Only a parameter whose type Postgres cannot infer rules the
+                # statement out for good. Anything else, e.g. a table that a
+                # pending migration creates, falls back for this call only.
+                if isinstance(e, (psycopg2.errors.IndeterminateDatatype, psycopg2.errors.AmbiguousParameter)):
+                    mark_unpreparable(query)
+                return False
+            if savepoint:
+                cur.execute("RELEASE SAVEPOINT prepare_statement")
+        conn.prepared[query.name] = True
+        count("prepares")
+        return True
+
+    def _finish(self, query, vars, start, explain=True, error=None):
+        elapsed = time.perf_counter() - start
+        record_timing("db_query", elapsed)
+        if not tracer.is_slow(elapsed):
+            return None
+        return tracer.trace(self._sql_text(query), vars, elapsed, explain=explain, error=error)
+
+    def _sql_text(self, query):
+        if isinstance(query, bytes):
+            return query.decode("utf-8")
+        if not isinstance(query, str):
+            return query.as_string(self)  # psycopg2.sql composables
+        return query
+
+    def _explain(self, query, vars, record):
+        # Re-runs the read on a plain cursor of the same connection, inside a
+        # savepoint when a transaction is open so that a failure cannot abort it.
+        conn = self.connection
+        savepoint = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                if savepoint:
+                    cur.execute("SAVEPOINT slow_query_explain")
+                try:
+                    if should_prepare(query) and getattr(conn, "prepared", {}).get(query.name) is True:
+                        # The plan the prepared statement actually runs, possibly generic.
+                        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query.execute_sql, query.arguments(vars))
+                    else:
+                        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + self._sql_text(query), vars)
+                    plan = "\n".join(row[0] for row in cur.fetchall())
+                finally:
+                    if savepoint:
+                        cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                        cur.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception as e:
+            tracer.add_plan(record, error=e)
+            return
+        tracer.add_plan(record, plan)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    # Pooled connections remember which statements their session has prepared.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = {}  # statement name -> True, or False once invalidated
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Connections are handed out LIFO so that the hottest ones stay warm, idle
+    connections are health-checked before reuse and callers wait at most
+    ``timeout`` seconds for a free slot before getting a 503.
+    """
+
+    def __init__(self, minconn=None, maxconn=None, timeout=None, healthcheck_idle=None, **dsn):
+        self.dsn = {"connection_factory": PreparingConnection, "cursor_factory": TimedCursor, **dsn}
+        self.minconn = POOL_MIN if minconn is None else minconn
+        self.maxconn = POOL_MAX if maxconn is None else maxconn
+        self.timeout = POOL_TIMEOUT if timeout is None else timeout
+        self.healthcheck_idle = POOL_HEALTHCHECK_IDLE if healthcheck_idle is None else healthcheck_idle
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, returned_at) pairs, most recently used last
+        self._size = 0   # open connections, idle or in use
+        self._closed = False
+        self._stats = {
+            "connects": 0,
+            "connect_errors": 0,
+            "acquired": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "healthcheck_failures": 0,
+            "discarded": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    def open(self):
+        with self._cond:
+            self._closed = False
+            missing = self.minconn - self._size
+            self._size += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            try:
+                conn = self._connect()
+            except HTTPException:
+                with self._cond:
+                    self._size -= 1
+                continue
+            self.putconn(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+    def _connect(self):
+        start = time.perf_counter()
+        try:
+            conn = psycopg2.connect(**self.dsn)
+        except Exception:
+            self._stats["connect_errors"] += 1
+            raise HTTPException(status_code=500, detail="Database connection error")
+        finally:
+            record_timing("db_connect", time.perf_counter() - start)
+        self._stats["connects"] += 1
+        return conn
+
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise HTTPException(status_code=503, detail="Database pool closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise HTTPException(status_code=503, detail="Database pool exhausted")
+                waited = True
+                self._cond.wait(remaining)
+            self._stats["acquired"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_seconds_total"] += time.monotonic() - start
+
+        if conn is not None and not self._healthy(conn, returned_at):
+            self._stats["healthcheck_failures"] += 1
+            self._discard(conn, keep_slot=True)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except HTTPException:
+                self._release_slot()
+                raise
+        return conn
+
+    def putconn(self, conn):
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._discard(conn)
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                conn.close()
+                return
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn, keep_slot=False):
+        self._stats["discarded"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        if not keep_slot:
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        # Uncommitted work is rolled back when the connection goes back to the pool.
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            size = self._size
+        return {
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "min": self.minconn,
+            "max": self.maxconn,
+            **self._stats,
+        }
@@ -0,0 +1,87 @@
+# common/encoding.py
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # optional speed-up, the stdlib encoder gives the same output
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is only offered when installed
+    msgpack = None
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.columnar+json"
+MSGPACK = "application/x-msgpack"
+COLUMNAR_MSGPACK = "application/vnd.columnar+msgpack"
+_ALIASES = {"application/msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError("Type is not serializable: %s" % type(value).__name__)
+
+
+def dumps_json(content):
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+def dumps_msgpack(content):
+    return msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+def records(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def columnar(columns, rows):
+    # {"column": [values...]}: no repeated keys and one array per column.
+    values = list(zip(*rows)) or [()] * len(columns)
+    return {column: list(column_values) for column, column_values in zip(columns, values)}
+
+
+ROW_ENCODERS = {
+    JSON: (records, dumps_json),
+    COLUMNAR_JSON: (columnar, dumps_json),
+    MSGPACK: (records, dumps_msgpack),
+    COLUMNAR_MSGPACK: (columnar, dumps_msgpack),
+}
+
+
+def negotiate(accept):
+    """Pick the row format for an Accept header; JSON unless asked otherwise."""
+    if not accept:
+        return JSON
+    offers = []
+    for index, part in enumerate(accept.split(",")):
+        media_type, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.strip().lower()
+        if quality > 0:
+            offers.append((-quality, index, _ALIASES.get(media_type, media_type)))
+    for _, _, media_type in sorted(offers):
+        if media_type in ROW_ENCODERS and (msgpack is not None or "msgpack" not in media_type):
+            return media_type
+    return JSON
+
+
+def encode_rows(media_type, columns, rows):
+    shape, dumps = ROW_ENCODERS[media_type]
+    return dumps(shape(columns, rows))
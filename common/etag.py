@@ -0,0 +1,46 @@
+# common/etag.py
+import hashlib
+
+from fastapi import HTTPException
+
+# Version markers are built from Postgres' xmin, which changes on every
+# insert or update of a row. For a list, the marker aggregates the ids and
+# xmins of its rows, so additions, updates and removals all change it:
+#     md5(string_agg(id || ':' || xmin, ',' ORDER BY id))
+
+
+def make_etag(version, *variant):
+    """Weak validator for one representation of a versioned resource.
+
+    ``variant`` holds whatever else shapes the body: the resource and its
+    parameters, and the negotiated media type. The tag is weak because
+    GZipMiddleware sends the same one with the gzipped and the identity body,
+    which are equivalent but not byte-identical.
+    """
+    digest = hashlib.blake2b(repr((version,) + variant).encode("utf-8"), digest_size=16).hexdigest()
+    return 'W/"%s"' % digest
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored. "*"
+    # matches any current representation: callers check that the resource
+    # exists first.
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == opaque:
+            return True
+    return False
+
+
+def check_not_modified(if_none_match, etag, vary=None):
+    # Starlette answers a 304 HTTPException with an empty body and these headers.
+    if etag_matches(if_none_match, etag):
+        headers = {"ETag": etag}
+        if vary:
+            headers["Vary"] = vary
+        raise HTTPException(status_code=304, headers=headers)
@@ -0,0 +1,254 @@
+# common/export.py
+import csv
+import io
+import json
+import os
+import threading
+
+from fastapi import HTTPException
+
+from common.encoding import columnar, dumps_json
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet is only offered when installed
+    pyarrow = None
+
+# Rows per fetch from the server-side cursor, i.e. the most an export holds
+# in memory at once.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+# Exports hold a connection and a snapshot for their whole run.
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+# Rows per part file written by export jobs.
+EXPORT_PART_ROWS = int(os.getenv("EXPORT_PART_ROWS", "1000000"))
+
+CSV, COLUMNAR, PARQUET = "csv", "columnar", "parquet"
+MEDIA_TYPES = {CSV: "text/csv; charset=utf-8", COLUMNAR: "application/x-ndjson", PARQUET: "application/vnd.apache.parquet"}
+EXTENSIONS = {CSV: "csv", COLUMNAR: "ndjson", PARQUET: "parquet"}
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def format_available(fmt):
+    return fmt != PARQUET or pyarrow is not None
+
+
+def check_format(fmt):
+    if not format_available(fmt):
+        raise HTTPException(status_code=400, detail="Parquet export needs pyarrow")
+
+
+def begin_snapshot(conn):
+    # Every cursor of the export reads the same snapshot, even across tables.
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+
+
+def fetch_batches(conn, name, sql, params, batch_size=None):
+    # Named (server-side) cursor: Postgres keeps the result and hands it over
+    # batch_size rows at a time.
+    with conn.cursor(name=name) as cur:
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size or EXPORT_BATCH_SIZE)
+            if not rows:
+                return
+            yield rows
+
+
+class CsvEncoder:
+    def __init__(self, columns, header=True):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        if header:
+            self._writer.writerow([name for name, _ in columns])
+
+    def encode(self, rows):
+        self._writer.writerows(rows)
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data.encode("utf-8")
+
+    def finish(self):
+        return self.encode(())
+
+
+class ColumnarEncoder:
+    # One {"column": [values...]} object per batch and line.
+    def __init__(self, columns, header=True):
+        self.names = [name for name, _ in columns]
+
+    def encode(self, rows):
+        return dumps_json(columnar(self.names, rows)) + b"\n"
+
+    def finish(self):
+        return b""
+
+
+class _Sink:
+    # Write-only file handing Parquet bytes over as the writer produces them.
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ParquetEncoder:
+    # One row group per batch; the footer, and so a readable file, comes with finish().
+    def __init__(self, columns, header=True):
+        types = {
+            "int": pyarrow.int64(),
+            "float": pyarrow.float64(),
+            "str": pyarrow.string(),
+            "timestamp": pyarrow.timestamp("us", tz="UTC"),
+        }
+        self.names = [name for name, _ in columns]
+        self.schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+        self._sink = _Sink()
+        self._writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(self._sink, mode="w"), self.schema)
+
+    def encode(self, rows):
+        self._writer.write_table(pyarrow.Table.from_pydict(columnar(self.names, rows), schema=self.schema))
+        return self._sink.drain()
+
+    def finish(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+ENCODERS = {CSV: CsvEncoder, COLUMNAR: ColumnarEncoder, PARQUET: ParquetEncoder}
+
+
+def encode_stream(fmt, columns, batches, header=True):
+    """Encodes row batches into response chunks, one or more per batch.
+
+    ``columns`` is a sequence of (name, kind) pairs, kind being one of int,
+    float, str or timestamp (used for the Parquet schema).
+    """
+    encoder = ENCODERS[fmt](columns, header)
+    for rows in batches:
+        data = encoder.encode(rows)
+        if data:
+            yield data
+    data = encoder.finish()
+    if data:
+        yield data
+
+
+class ExportSlot:
+    def __init__(self, limiter):
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        # Idempotent: called when the stream ends and again by the response's
+        # background task, which also runs if the stream never started.
+        with self._limiter._lock:
+            if not self._released:
+                self._released = True
+                self._limiter._running -= 1
+
+
+class ExportLimiter:
+    """Bounds concurrent exports; the excess gets 429 with Retry-After."""
+
+    def __init__(self, limit=None):
+        self.limit = EXPORT_MAX_CONCURRENT if limit is None else limit
+        self._lock = threading.Lock()
+        self._running = 0
+        self._stats = {"started": 0, "rejected": 0}
+
+    def acquire(self):
+        with self._lock:
+            if self._running >= self.limit:
+                self._stats["rejected"] += 1
+                raise HTTPException(status_code=429, detail="Too many exports running", headers={"Retry-After": "30"})
+            self._running += 1
+            self._stats["started"] += 1
+        return ExportSlot(self)
+
+    def stats(self):
+        with self._lock:
+            return {"running": self._running, "limit": self.limit, **self._stats}
+
+
+def _save_checkpoint(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def run_job(directory, fmt, columns, batches_after, job, part_rows=None):
+    """Exports to numbered part files in ``directory``, resumably.
+
+    ``batches_after(after)`` yields row batches ordered by their first
+    column (the id) and starting after ``after`` (None for the beginning).
+    Each part is a complete file of about ``part_rows`` rows. Once a part is
+    fsynced, checkpoint.json records it and the last id it holds, so a job
+    interrupted at any point restarts from the last complete part. ``job``
+    describes the export (kind, format, filters); a directory holding a
+    different job is refused.
+    """
+    part_rows = part_rows or EXPORT_PART_ROWS
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    state = {"job": job, "after": None, "parts": 0, "rows": 0, "done": False}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if saved["job"] != job:
+            raise ValueError("%s holds a different export: %s" % (directory, saved["job"]))
+        state = saved
+    if state["done"]:
+        return state
+
+    part, encoder, rows_in_part = None, None, 0
+    for rows in batches_after(state["after"]):
+        if part is None:
+            part = open(os.path.join(directory, "part-%05d.%s" % (state["parts"], EXTENSIONS[fmt])), "wb")
+            encoder = ENCODERS[fmt](columns)
+        part.write(encoder.encode(rows))
+        rows_in_part += len(rows)
+        state["after"] = rows[-1][0]
+        if rows_in_part >= part_rows:
+            _close_part(part, encoder, state, rows_in_part, path)
+            part, encoder, rows_in_part = None, None, 0
+    if part is not None:
+        _close_part(part, encoder, state, rows_in_part, path)
+    state["done"] = True
+    _save_checkpoint(path, state)
+    return state
+
+
+def _close_part(part, encoder, state, rows, checkpoint_path):
+    part.write(encoder.finish())
+    part.flush()
+    os.fsync(part.fileno())
+    part.close()
+    state["parts"] += 1
+    state["rows"] += rows
+    _save_checkpoint(checkpoint_path, state)
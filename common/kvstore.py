@@ -0,0 +1,265 @@
+# common/kvstore.py
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+from common.encoding import dumps_json, dumps_msgpack, msgpack
+
+# Rewrite the log once dead records make up this share of it, and it is at
+# least COMPACT_MIN_BYTES long.
+KV_COMPACT_RATIO = float(os.getenv("KV_COMPACT_RATIO", "0.5"))
+KV_COMPACT_MIN_BYTES = int(os.getenv("KV_COMPACT_MIN_BYTES", str(1 << 20)))
+# fsync after every write; turn off to trade durability for write latency.
+KV_FSYNC = os.getenv("KV_FSYNC", "1").lower() in ("1", "true", "yes")
+
+# Record: crc32, flags, key length, value length, key, value. The crc covers
+# everything after itself, so a torn or corrupt tail is detected on scan.
+HEADER = struct.Struct("<IBHI")
+FLAG_MSGPACK = 1
+SCAN_CHUNK = 1 << 20
+
+logger = logging.getLogger("kvstore")
+
+
+def _encode(value):
+    if msgpack is not None:
+        return FLAG_MSGPACK, dumps_msgpack(value)
+    return 0, dumps_json(value)
+
+
+def _write_all(fd, data):
+    # os.write may write less than asked, e.g. when interrupted by a signal.
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _decode(flags, data):
+    if flags & FLAG_MSGPACK:
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+class LogStore:
+    """Embedded persistent key-value store: an append-only log plus an index.
+
+    Every put appends one self-checking record and points the in-memory index
+    (key -> offset and length of the latest record) at it; reads are a single
+    pread served from the page cache. Several processes can share one file:
+    writers serialize on an flock'ed ``<path>.lock``, and every operation
+    first stats the log, so a process picks up the others' appends (and
+    compactions, which atomically replace the file) before it answers.
+    Compaction rewrites only the live records once the dead ones pass
+    ``compact_ratio`` of the file.
+    """
+
+    def __init__(self, path, compact_ratio=None, compact_min_bytes=None, fsync=None):
+        self.path = path
+        self.compact_ratio = KV_COMPACT_RATIO if compact_ratio is None else compact_ratio
+        self.compact_min_bytes = KV_COMPACT_MIN_BYTES if compact_min_bytes is None else compact_min_bytes
+        self.fsync = KV_FSYNC if fsync is None else fsync
+        self._lock = threading.Lock()
+        self._fd = None
+        self._lock_fd = None
+        self._ino = None
+        self._size = 0
+        self._live_bytes = 0
+        self._index = {}  # key -> (offset, length, flags, value offset)
+        self._stats = {"reads": 0, "writes": 0, "refreshes": 0, "compactions": 0, "truncated_bytes": 0,
+                       "corrupt_bytes": 0}
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        with self._lock, self._exclusive():
+            self._reopen()
+
+    def close(self):
+        with self._lock:
+            for fd in (self._fd, self._lock_fd):
+                if fd is not None:
+                    os.close(fd)
+            self._fd = self._lock_fd = None
+            self._index = {}
+
+    @contextmanager
+    def _exclusive(self):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _reopen(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._ino = os.fstat(self._fd).st_ino
+        self._index = {}
+        self._size = self._live_bytes = 0
+        self._scan()
+
+    def _scan(self):
+        # Indexes the records appended since the last scan. Called with the
+        # file lock held, so a partial record can only be left by a crash:
+        # one that nothing valid follows is a torn tail and is cut off. A bad
+        # record with valid ones after it is corruption inside the file; it
+        # is skipped, and its key keeps its previous value.
+        end = os.fstat(self._fd).st_size
+        offset = self._size
+        # The dup shares the file position, which pread and O_APPEND writes ignore.
+        with os.fdopen(os.dup(self._fd), "rb", buffering=SCAN_CHUNK) as f:
+            f.seek(offset)
+            while offset + HEADER.size <= end:
+                header = f.read(HEADER.size)
+                crc, flags, key_length, value_length = HEADER.unpack(header)
+                length = HEADER.size + key_length + value_length
+                payload = f.read(key_length + value_length) if offset + length <= end else b""
+                if len(payload) != key_length + value_length or zlib.crc32(header[4:] + payload) != crc:
+                    resume = self._next_record(offset + 1, end)
+                    if resume is None:
+                        break
+                    logger.error("%s: skipped %d corrupt bytes at offset %d", self.path, resume - offset, offset)
+                    self._stats["corrupt_bytes"] += resume - offset
+                    offset = resume
+                    f.seek(offset)
+                    continue
+                key = payload[:key_length].decode("utf-8")
+                previous = self._index.get(key)
+                if previous is not None:
+                    self._live_bytes -= previous[1]
+                self._index[key] = (offset, length, flags, offset + HEADER.size + key_length)
+                self._live_bytes += length
+                offset += length
+        if offset < end:
+            self._stats["truncated_bytes"] += end - offset
+            os.ftruncate(self._fd, offset)
+        self._size = offset
+
+    def _next_record(self, offset, end):
+        # First offset in [offset, end) where a whole record with a valid crc
+        # starts, or None. Byte by byte, but only ever run past a bad record.
+        while offset + HEADER.size <= end:
+            header = os.pread(self._fd, HEADER.size, offset)
+            crc, _, key_length, value_length = HEADER.unpack(header)
+            length = HEADER.size + key_length + value_length
+            if offset + length <= end:
+                payload = os.pread(self._fd, key_length + value_length, offset + HEADER.size)
+                if zlib.crc32(header[4:] + payload) == crc:
+                    return offset
+            offset += 1
+        return None
+
+    def _refresh(self):
+        # One stat per call: another process appended or compacted meanwhile.
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if st is not None and st.st_ino == self._ino and st.st_size == self._size:
+            return
+        self._stats["refreshes"] += 1
+        with self._exclusive():
+            self._catch_up()
+
+    def _catch_up(self):
+        # With the file lock held.
+        try:
+            replaced = os.stat(self.path).st_ino != self._ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._reopen()
+        else:
+            self._scan()
+
+    def _read(self, entry):
+        offset, length, flags, value_offset = entry
+        return _decode(flags, os.pread(self._fd, offset + length - value_offset, value_offset))
+
+    def get(self, key, default=None):
+        return self.lookup(key, default)[1]
+
+    def lookup(self, key, default=None):
+        """Returns (version, value); the version changes whenever the key is written."""
+        with self._lock:
+            self._refresh()
+            self._stats["reads"] += 1
+            entry = self._index.get(key)
+            if entry is None:
+                return None, default
+            return (self._ino, entry[0]), self._read(entry)
+
+    def put(self, key, value):
+        return self.update(key, lambda _: value)
+
+    def update(self, key, fn, default=None):
+        """Atomically replaces the value of key with fn(current value)."""
+        with self._lock, self._exclusive():
+            self._catch_up()
+            entry = self._index.get(key)
+            value = fn(default if entry is None else self._read(entry))
+            key_bytes = key.encode("utf-8")
+            flags, data = _encode(value)
+            body = HEADER.pack(0, flags, len(key_bytes), len(data))[4:] + key_bytes + data
+            record = struct.pack("<I", zlib.crc32(body)) + body
+            try:
+                _write_all(self._fd, record)
+            except OSError:
+                # Cut a partly written record so that the next write starts clean.
+                os.ftruncate(self._fd, self._size)
+                raise
+            if self.fsync:
+                os.fsync(self._fd)
+            if entry is not None:
+                self._live_bytes -= entry[1]
+            self._index[key] = (self._size, len(record), flags, self._size + HEADER.size + len(key_bytes))
+            self._live_bytes += len(record)
+            self._size += len(record)
+            self._stats["writes"] += 1
+            if self._size >= self.compact_min_bytes and self._size - self._live_bytes > self._size * self.compact_ratio:
+                self._compact()
+            return value
+
+    def compact(self):
+        with self._lock, self._exclusive():
+            self._catch_up()
+            self._compact()
+
+    def _compact(self):
+        # Copies the live records verbatim to a new file and swaps it in;
+        # other processes notice the new inode on their next call.
+        tmp_path = self.path + ".compact"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        index, offset = {}, 0
+        try:
+            for key, (old_offset, length, flags, value_offset) in sorted(self._index.items(), key=lambda item: item[1][0]):
+                _write_all(fd, os.pread(self._fd, length, old_offset))
+                index[key] = (offset, length, flags, offset + value_offset - old_offset)
+                offset += length
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, self.path)
+        os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        self._ino = os.fstat(self._fd).st_ino
+        self._index = index
+        self._size = self._live_bytes = offset
+        self._stats["compactions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._index),
+                "file_bytes": self._size,
+                "live_bytes": self._live_bytes,
+                **self._stats,
+            }
@@ -0,0 +1,234 @@
+# common/metrics.py
+import contextvars
+import threading
+import time
+
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+from common.encoding import dumps_json, encode_rows, negotiate
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request accumulator for the connect/query/serialize breakdown. The dict
+# is shared with the threadpool and generator threads, which copy the context.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+# The request's ASGI scope, in which routing records the matched route.
+_request_scope = contextvars.ContextVar("request_scope", default=None)
+
+
+def record_timing(kind, seconds):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[kind] = timings.get(kind, 0.0) + seconds
+
+
+def current_route():
+    # "METHOD /route/{template}" of the request being served, for tracing.
+    request = _request_scope.get()
+    if request is None:
+        return None
+    middleware, scope = request
+    return "%s %s" % (scope["method"], middleware._route_path(scope))
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (name, str(value).replace('"', '\\"')) for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append("%s%s %s" % (self.name, _format_labels(self.labelnames, labels), value))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, series in self._series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append("%s_bucket%s %d" % (self.name, _format_labels(names, labels + (bound,)), cumulative))
+                lines.append("%s_bucket%s %d" % (self.name, _format_labels(names, labels + ("+Inf",)), series[-1]))
+                lines.append("%s_sum%s %f" % (self.name, _format_labels(self.labelnames, labels), series[-2]))
+                lines.append("%s_count%s %d" % (self.name, _format_labels(self.labelnames, labels), series[-1]))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # (prefix, fn returning a flat dict of numbers)
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix, fn):
+        # Stats dicts such as ConnectionPool.stats() are exported as gauges.
+        self.collectors.append((prefix, fn))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, fn in self.collectors:
+            for key, value in fn().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = "%s_%s" % (prefix, key)
+                lines.append("# TYPE %s gauge" % name)
+                lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every request by route template."""
+
+    def __init__(self, app, registry):
+        self.app = app
+        self.in_flight = 0
+        self._route_paths = None
+        self.requests = registry.counter(
+            "http_requests_total", "Requests by route, method and status.", ("route", "method", "status")
+        )
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "End-to-end request latency.", ("route", "method")
+        )
+        self.breakdown = {
+            kind: registry.histogram(
+                "http_request_%s_seconds" % kind, "Time spent in %s per request." % label, ("route", "method")
+            )
+            for kind, label in (("db_connect", "opening database connections"),
+                                ("db_query", "executing database queries"),
+                                ("serialize", "rendering the response body"))
+        }
+        registry.add_collector("http_requests", lambda: {"in_flight": self.in_flight})
+
+    def _route_path(self, scope):
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        # Older Starlette only records the endpoint.
+        if self._route_paths is None:
+            self._route_paths = {
+                getattr(r, "endpoint", None): r.path for r in scope["app"].router.routes if hasattr(r, "path")
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = {}
+        token = _request_timings.set(timings)
+        scope_token = _request_scope.set((self, scope))
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight -= 1
+            _request_timings.reset(token)
+            _request_scope.reset(scope_token)
+            labels = (self._route_path(scope), scope["method"])
+            self.requests.inc(labels + (status[0],))
+            self.latency.observe(labels, elapsed)
+            for kind, histogram in self.breakdown.items():
+                if kind in timings:
+                    histogram.observe(labels, timings[kind])
+
+
+class TimedJSONResponse(JSONResponse):
+    # Default response class: times JSON rendering for the serialize breakdown.
+    def render(self, content):
+        start = time.perf_counter()
+        body = dumps_json(content)
+        record_timing("serialize", time.perf_counter() - start)
+        return body
+
+
+class TimedRowsResponse(Response):
+    """Tabular results in the format the client asked for.
+
+    Handlers return column names and raw row tuples, which are encoded once,
+    without FastAPI's jsonable_encoder pass: JSON records by default, or
+    MessagePack and columnar variants (see common/encoding.py) for internal
+    consumers that send a matching Accept header.
+    """
+
+    def __init__(self, columns, rows, accept=None, status_code=200, headers=None):
+        self.columns = columns
+        super().__init__(
+            rows, status_code=status_code, headers={"Vary": "Accept", **(headers or {})}, media_type=negotiate(accept)
+        )
+
+    def render(self, content):
+        start = time.perf_counter()
+        body = encode_rows(self.media_type, self.columns, content)
+        record_timing("serialize", time.perf_counter() - start)
+        return body
+
+
+def install_metrics(app):
+    registry = Registry()
+    app.add_middleware(MetricsMiddleware, registry=registry)
+
+    @app.get("/metrics", include_in_schema=False)
+    def get_metrics():
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+    return registry
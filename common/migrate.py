@@ -0,0 +1,148 @@
+# common/migrate.py
+import itertools
+import json
+import os
+import re
+
+from common.prepared import numbered
+
+# Each service owns its schema as numbered SQL files in <service>/migrations
+# (NNNN_description.sql), applied in order and recorded in schema_migrations.
+# A file whose leading comments include NO_TRANSACTION runs statement by statement outside a
+# transaction, which CREATE INDEX CONCURRENTLY requires. If such a build
+# fails, Postgres leaves an INVALID index behind that IF NOT EXISTS would
+# skip: drop it before running the migration again.
+MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# Serializes concurrent runners, e.g. several containers starting at once.
+MIGRATIONS_LOCK = 7268354
+
+
+def migration_files(directory):
+    files = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            files.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    return sorted(files)
+
+
+def split_statements(sql):
+    # Good enough for migration files: no semicolons inside literals or bodies.
+    code = "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--"))
+    return [statement.strip() for statement in code.split(";") if statement.strip()]
+
+
+def migrate(conn, directory):
+    """Applies the pending migrations in ``directory``; returns their names.
+
+    ``conn`` is a dedicated connection, left in autocommit mode.
+    """
+    conn.autocommit = True
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute(MIGRATIONS_TABLE)
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK,))
+        try:
+            cur.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cur.fetchall()}
+            for version, name, path in migration_files(directory):
+                if version in done:
+                    continue
+                with open(path) as f:
+                    sql = f.read()
+                header = itertools.takewhile(lambda line: line.startswith("--"), sql.splitlines())
+                if NO_TRANSACTION in (line.strip() for line in header):
+                    for statement in split_statements(sql):
+                        cur.execute(statement)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                else:
+                    cur.execute("BEGIN")
+                    try:
+                        cur.execute(sql)
+                        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                    except Exception:
+                        cur.execute("ROLLBACK")
+                        raise
+                    cur.execute("COMMIT")
+                applied.append("%04d_%s" % (version, name))
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK,))
+    return applied
+
+
+# An index scan that tests the lookup key (user_id = $1) as a Filter walks the
+# index in some other order, e.g. the primary key in id order.
+KEY_FILTER = re.compile(r"\((\w+_id|id) = (\$\d+|'?-?\d+'?)(::\w+)?\)")
+
+
+def seq_scans(plan, small_tables=()):
+    # A walk of a whole index reads as much as a sequential scan. Tables in
+    # small_tables (reference data that does not grow with users) may be read
+    # in full.
+    tables = []
+    if plan.get("Relation Name") in small_tables:
+        pass
+    elif plan["Node Type"] == "Seq Scan":
+        tables.append(plan["Relation Name"])
+    elif plan["Node Type"] in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+        if "Index Cond" not in plan or KEY_FILTER.search(plan.get("Filter", "")):
+            tables.append(plan["Index Name"])
+    for child in plan.get("Plans", ()):
+        tables.extend(seq_scans(child, small_tables))
+    return tables
+
+
+def check_plans(conn, checks, small_tables=()):
+    """EXPLAINs each (name, sql, params) and returns the ones that scan a whole table.
+
+    Each query is prepared and its generic plan explained, the one a pooled
+    connection settles on for prepared statements, so a plan that only holds
+    for the sample parameters does not pass. Sequential scans are disabled
+    for the check, so the planner only picks one when no index can serve the
+    query, whatever the table sizes are.
+    Returns (name, [tables or indexes read in full]) pairs.
+    """
+    failures = []
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        cur.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+        for name, sql, params in checks:
+            body, keys = numbered(sql)
+            cur.execute("PREPARE plan_check AS " + body)
+            if keys:
+                args = tuple(params[key] for key in keys)
+                cur.execute("EXPLAIN (FORMAT JSON) EXECUTE plan_check (%s)" % ", ".join(["%s"] * len(keys)), args)
+            else:
+                cur.execute("EXPLAIN (FORMAT JSON) EXECUTE plan_check")
+            plan = cur.fetchone()[0]
+            cur.execute("DEALLOCATE plan_check")
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = seq_scans(plan[0]["Plan"], small_tables)
+            if tables:
+                failures.append((name, tables))
+    conn.rollback()
+    return failures
+
+
+def run_plan_checks(checks_by_pool, small_tables=()):
+    # CLI helper: prints one line per query and returns the process exit code.
+    status = 0
+    for pool, checks in checks_by_pool:
+        with pool.connection() as conn:
+            failures = dict(check_plans(conn, checks, small_tables))
+        for name, _, _ in checks:
+            if name in failures:
+                status = 1
+                print("FAIL %s: full scan of %s" % (name, ", ".join(failures[name])))
+            else:
+                print("ok   %s" % name)
+    return status
@@ -0,0 +1,159 @@
+# common/prepared.py
+import itertools
+import os
+import re
+import threading
+
+# Statements wrapped in prepared() are parsed and planned once per pooled
+# connection and then run with EXECUTE. PREPARED_STATEMENTS=0 sends them as
+# plain queries again.
+PREPARED_ENABLED = os.getenv("PREPARED_STATEMENTS", "1").lower() in ("1", "true", "yes")
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+_WHITESPACE = re.compile(r"\s+")
+_names = itertools.count(1)
+_lock = threading.Lock()
+_stats = {"prepares": 0, "executes": 0, "hits": 0, "invalidations": 0, "retries": 0, "unpreparable": 0}
+_statements = {}  # name -> PreparedSQL, to label Postgres' counters
+# Names of statements Postgres refused to prepare; they run as plain queries.
+_unpreparable = set()
+
+
+class PreparedSQL(str):
+    """A psycopg2 SQL string that TimedCursor runs as a prepared statement.
+
+    It is still a plain ``str`` for every other consumer (asyncpg, EXPLAIN,
+    logging). ``body`` is the statement with ``$n`` placeholders, in the order
+    given by ``keys``: positions for ``%s`` parameters, names for
+    ``%(name)s`` ones, so a repeated name is sent once.
+    """
+
+    def __new__(cls, sql):
+        self = super().__new__(cls, sql)
+        with _lock:
+            self.name = "ps_%d" % next(_names)
+            _statements[self.name] = self
+        self.body, self.keys = numbered(sql)
+        placeholders = ", ".join(["%s"] * len(self.keys))
+        self.execute_sql = "EXECUTE %s (%s)" % (self.name, placeholders) if self.keys else "EXECUTE %s" % self.name
+        return self
+
+    def arguments(self, vars):
+        if not self.keys:
+            return None
+        return tuple(vars[key] for key in self.keys)
+
+    def prepare_sql(self, args):
+        # Integers are declared bigint so that an id past the int range still
+        # finds no row instead of failing, as it does unprepared; Postgres
+        # infers the other types from the statement. Values past bigint are
+        # never sent to EXECUTE (see fits_prepared).
+        if not self.keys:
+            return "PREPARE %s AS %s" % (self.name, self.body)
+        return "PREPARE %s (%s) AS %s" % (self.name, ", ".join(_param_type(arg) for arg in args), self.body)
+
+
+def numbered(sql):
+    # psycopg2 placeholders to $n ones: returns the new text and the key of
+    # each $n, a position for %s and a name for %(name)s.
+    positions = {}
+
+    def number(match):
+        if match.group(0) == "%%":
+            return "%"
+        key = match.group(1) if match.group(1) is not None else len(positions)
+        if key not in positions:
+            positions[key] = len(positions) + 1
+        return "$%d" % positions[key]
+
+    return _PLACEHOLDER.sub(number, sql), list(positions)
+
+
+BIGINT_MIN, BIGINT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _integers(args):
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            yield from _integers(arg)
+        elif isinstance(arg, int) and not isinstance(arg, bool):
+            yield arg
+
+
+def fits_prepared(args):
+    # An integer past bigint would fail the cast to the declared parameter
+    # type inside EXECUTE; as a plain query it is a numeric literal that
+    # simply matches no row.
+    return all(BIGINT_MIN <= value <= BIGINT_MAX for value in _integers(args or ()))
+
+
+def _param_type(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return "bigint"
+    if isinstance(value, (list, tuple)) and value and all(
+        isinstance(item, int) and not isinstance(item, bool) for item in value
+    ):
+        return "bigint[]"
+    return "unknown"
+
+
+def prepared(sql):
+    """Marks a fixed, module-level statement for server-side preparation.
+
+    Only wrap statements built once: every distinct string is prepared on
+    every connection it runs on.
+    """
+    return PreparedSQL(sql)
+
+
+def should_prepare(query):
+    return PREPARED_ENABLED and isinstance(query, PreparedSQL) and query.name not in _unpreparable
+
+
+def mark_unpreparable(query):
+    with _lock:
+        _unpreparable.add(query.name)
+        _stats["unpreparable"] = len(_unpreparable)
+
+
+def count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def prepared_stats():
+    # hits / executes is the share of executions that skipped parse and plan.
+    with _lock:
+        return {"enabled": PREPARED_ENABLED, **_stats}
+
+
+PLAN_CACHE_SQL = """
+    SELECT name, generic_plans, custom_plans FROM pg_prepared_statements
+    WHERE name LIKE 'ps\\_%' ORDER BY generic_plans + custom_plans DESC
+"""
+
+
+def plan_cache_stats(conn):
+    # Postgres' own counters for one connection's statements: after five
+    # executions a statement switches to a generic plan unless custom ones
+    # are cheaper, and only generic executions skip planning.
+    with conn.cursor() as cur:
+        cur.execute(PLAN_CACHE_SQL)
+        rows = cur.fetchall()
+    conn.rollback()
+    return [
+        {"name": name, "sql": _WHITESPACE.sub(" ", _statements.get(name, "")).strip(),
+         "generic_plans": generic, "custom_plans": custom}
+        for name, generic, custom in rows
+    ]
+
+
+def install_prepared_stats(app, pool, registry):
+    # GET /stats/prepared and the db_prepared_* counters on /metrics.
+    registry.add_collector("db_prepared", prepared_stats)
+
+    @app.get("/stats/prepared")
+    def get_prepared_stats():
+        # Postgres counts plans per session: this samples one pooled connection.
+        with pool.connection() as conn:
+            return {**prepared_stats(), "connection": plan_cache_stats(conn)}
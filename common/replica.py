@@ -0,0 +1,268 @@
+# common/replica.py
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.cookies import CookieError, SimpleCookie
+
+import psycopg2
+import psycopg2.extensions
+from fastapi import HTTPException
+
+from common.aio import CONNECT_ERRORS, AsyncDatabase
+from common.db import ConnectionPool
+
+# Comma-separated libpq URIs or "host=... port=..." strings. Missing dbname,
+# user and password are taken from the primary's settings.
+REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("DATABASE_REPLICAS", "").split(",") if dsn.strip()]
+# Replicas further behind than this (seconds) are skipped until they catch up.
+REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "1"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_CHECK_INTERVAL", "1"))
+# An unreachable replica must not stall the lag checks for long.
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("DATABASE_REPLICA_CONNECT_TIMEOUT", "2"))
+# After a successful write, the same client reads from the primary this long.
+REPLICA_STICKY_SECONDS = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "5"))
+STICKY_COOKIE = "db_primary_until"
+
+# A standalone server (not in recovery) reports no lag, so two independent
+# local instances can stand in for a primary and its replica.
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Per-request routing state set by ReadYourWritesMiddleware. The first read
+# of a request picks a server and later reads reuse it, so that a version
+# check and the query it guards see the same (or a newer) snapshot.
+_route = contextvars.ContextVar("replica_route", default=None)
+
+
+def sticky_request():
+    # True while the request being served reads from the primary after the
+    # client's own write.
+    route = _route.get()
+    return bool(route and route.get("sticky"))
+
+
+class Replica:
+    def __init__(self, name, pool, adb):
+        self.name = name
+        self.pool = pool
+        self.adb = adb
+        self.healthy = False  # until the first lag check succeeds
+        self.lag = None
+        self.reads = 0
+
+    def stats(self):
+        return {"name": self.name, "healthy": self.healthy, "lag_seconds": self.lag, "reads": self.reads}
+
+
+class ReplicaSet:
+    """Routes reads to streaming replicas and everything else to the primary.
+
+    A background thread measures each replica's replay lag every
+    ``check_interval`` seconds. Reads go round-robin to the healthy replicas
+    within ``max_lag`` and fall back to the primary when there are none, when
+    a replica refuses connections, or when the request is sticky to the
+    primary after the client's own write (see ReadYourWritesMiddleware).
+    With no replicas configured every read simply uses the primary.
+    """
+
+    def __init__(self, primary, primary_async, dbname, user, password, dsns=None, max_lag=None, check_interval=None):
+        self.primary = primary
+        self.primary_async = primary_async
+        self.max_lag = REPLICA_MAX_LAG if max_lag is None else max_lag
+        self.check_interval = REPLICA_CHECK_INTERVAL if check_interval is None else check_interval
+        self.replicas = []
+        for dsn in REPLICA_DSNS if dsns is None else dsns:
+            params = {
+                "dbname": dbname, "user": user, "password": password, "connect_timeout": REPLICA_CONNECT_TIMEOUT,
+                **psycopg2.extensions.parse_dsn(dsn),
+            }
+            pool = ConnectionPool(**params)
+            adb = AsyncDatabase(
+                pool, host=params.get("host"), port=params.get("port", 5432),
+                dbname=params["dbname"], user=params["user"], password=params["password"]
+            )
+            self.replicas.append(Replica("%s:%s" % (params.get("host"), params.get("port", 5432)), pool, adb))
+        self._next = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"primary_reads": 0, "replica_reads": 0, "sticky_reads": 0, "fallbacks": 0}
+
+    def open(self):
+        for replica in self.replicas:
+            replica.pool.open()
+        if self.replicas and self._thread is None:
+            self._stop.clear()
+            self.check_lag()
+            self._thread = threading.Thread(target=self._run, name="replica-lag", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        for replica in self.replicas:
+            replica.pool.close()
+
+    async def open_async(self):
+        # An unreachable replica must not fail startup: it is marked unhealthy,
+        # and fetch_all opens its pool once the lag check finds it back.
+        for replica in self.replicas:
+            try:
+                await replica.adb.open()
+            except CONNECT_ERRORS:
+                replica.healthy = False
+
+    async def close_async(self):
+        for replica in self.replicas:
+            await replica.adb.close()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check_lag()
+
+    def check_lag(self):
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection() as conn, conn.cursor() as cur:
+                    cur.execute(LAG_SQL)
+                    replica.lag = float(cur.fetchone()[0])
+                replica.healthy = True
+            except (HTTPException, psycopg2.Error):
+                replica.healthy = False
+
+    def _pick(self):
+        if not self.replicas:
+            return None
+        route = _route.get()
+        if route is None:
+            route = {}  # outside a request
+        if route.get("sticky"):
+            self._stats["sticky_reads"] += 1
+            return None
+        if "replica" in route:
+            return route["replica"]
+        candidates = [r for r in self.replicas if r.healthy and r.lag is not None and r.lag <= self.max_lag]
+        replica = candidates[next(self._next) % len(candidates)] if candidates else None
+        if replica is None:
+            self._stats["fallbacks"] += 1
+        route["replica"] = replica
+        return replica
+
+    def _unreachable(self, replica, exc):
+        # Pool timeouts (503) are load, not failure, and are not retried on the primary.
+        if exc.status_code != 500:
+            return False
+        replica.healthy = False
+        self._stats["fallbacks"] += 1
+        route = _route.get()
+        if route is not None:
+            route["replica"] = None  # the primary is never behind the replica
+        return True
+
+    @contextmanager
+    def connection(self):
+        # Drop-in for ConnectionPool.connection() in read-only handlers.
+        replica = self._pick()
+        if replica is not None:
+            try:
+                conn = replica.pool.getconn()
+            except HTTPException as e:
+                if not self._unreachable(replica, e):
+                    raise
+            else:
+                replica.reads += 1
+                self._stats["replica_reads"] += 1
+                try:
+                    yield conn
+                finally:
+                    replica.pool.putconn(conn)
+                return
+        self._stats["primary_reads"] += 1
+        with self.primary.connection() as conn:
+            yield conn
+
+    async def fetch_all(self, sql, params=()):
+        # Drop-in for AsyncDatabase.fetch_all() in read-only handlers.
+        replica = self._pick()
+        if replica is not None:
+            try:
+                rows = await replica.adb.fetch_all(sql, params)
+            except HTTPException as e:
+                if not self._unreachable(replica, e):
+                    raise
+            else:
+                replica.reads += 1
+                self._stats["replica_reads"] += 1
+                return rows
+        self._stats["primary_reads"] += 1
+        return await self.primary_async.fetch_all(sql, params)
+
+    def after_lag(self, fn, *args):
+        # Runs fn again once any replica read that raced a write has caught up,
+        # e.g. to drop a cache entry refilled from a lagging replica.
+        if self.replicas:
+            timer = threading.Timer(self.max_lag + self.check_interval, fn, args)
+            timer.daemon = True
+            timer.start()
+
+    def stats(self):
+        lags = [r.lag for r in self.replicas if r.healthy and r.lag is not None]
+        return {
+            "configured": len(self.replicas),
+            "healthy": sum(1 for r in self.replicas if r.healthy),
+            "max_lag_seconds": max(lags) if lags else 0,
+            **self._stats,
+            "replicas": [r.stats() for r in self.replicas],
+        }
+
+
+class ReadYourWritesMiddleware:
+    """Pins a client's reads to the primary for a while after its own write.
+
+    A successful non-GET request sets a short-lived cookie; requests carrying
+    an unexpired cookie read from the primary, so clients see their writes
+    even on a lagging replica.
+    """
+
+    def __init__(self, app, sticky_seconds=None):
+        self.app = app
+        self.sticky_seconds = REPLICA_STICKY_SECONDS if sticky_seconds is None else sticky_seconds
+
+    def _sticky_until(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                try:
+                    cookie = SimpleCookie(value.decode("latin-1"))
+                    return float(cookie[STICKY_COOKIE].value)
+                except (CookieError, KeyError, ValueError):
+                    return 0
+        return 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        now = time.time()
+        token = _route.set({"sticky": self._sticky_until(scope) > now})
+        send_wrapper = send
+        if scope["method"] not in ("GET", "HEAD", "OPTIONS"):
+            cookie = "%s=%.3f; Max-Age=%d; Path=/; HttpOnly" % (
+                STICKY_COOKIE, now + self.sticky_seconds, max(1, round(self.sticky_seconds))
+            )
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start" and message["status"] < 400:
+                    message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+                await send(message)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _route.reset(token)
@@ -0,0 +1,116 @@
+# common/singleflight.py
+import asyncio
+import copy
+import functools
+import threading
+
+from fastapi.responses import Response
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _own_copy(result):
+    # Responses are sent by reference: GZipMiddleware rewrites Content-Encoding
+    # and Content-Length in the raw header list in place, so every caller gets
+    # its own response object and header list.
+    if not isinstance(result, Response):
+        return result
+    response = copy.copy(result)
+    response.__dict__.pop("_headers", None)  # MutableHeaders view of the shared list
+    response.raw_headers = list(result.raw_headers)
+    return response
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for it and share its result (or exception) instead of
+    issuing the same query again. Nothing is cached once the call finishes.
+    A Response result is copied for each caller, leader included.
+
+    Calls for which ``bypass()`` returns true run on their own, e.g. requests
+    that must read their own writes from the primary.
+    """
+
+    def __init__(self, bypass=None):
+        self.bypass = bypass
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._stats = {"executed": 0, "coalesced": 0, "bypassed": 0}
+
+    def _bypassed(self):
+        if self.bypass is None or not self.bypass():
+            return False
+        with self._lock:
+            self._stats["bypassed"] += 1
+        return True
+
+    def do(self, key, fn, *args, **kwargs):
+        if self._bypassed():
+            return fn(*args, **kwargs)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["executed"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return _own_copy(call.result)
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        if self._bypassed():
+            return await fn(*args, **kwargs)
+        # Only touched from the event loop, so no lock is needed.
+        task = self._tasks.get(key)
+        if task is None:
+            self._stats["executed"] += 1
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self._stats["coalesced"] += 1
+        # shield: a cancelled caller must not cancel the query the others wait on.
+        return _own_copy(await asyncio.shield(task))
+
+    def coalesce(self, fn):
+        # Handlers are called with keyword arguments by FastAPI; they make the key.
+        name = fn.__module__ + "." + fn.__qualname__
+
+        def key_for(args, kwargs):
+            return (name, args, tuple(sorted(kwargs.items())))
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                return await self.do_async(key_for(args, kwargs), fn, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return self.do(key_for(args, kwargs), fn, *args, **kwargs)
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls) + len(self._tasks)
+            return {"in_flight": in_flight, **self._stats}
@@ -0,0 +1,40 @@
+# common/sql.py
+from fastapi import HTTPException
+from psycopg2 import sql
+
+
+def update_fields(model):
+    # Only the fields the client sent; None never overwrites a column.
+    return {name: value for name, value in model.dict(exclude_unset=True).items() if value is not None}
+
+
+def build_update(table, fields, where, returning, condition=None):
+    """Build one ``UPDATE ... SET a = %s, b = %s ... RETURNING`` statement.
+
+    ``fields`` and ``where`` map column names to values; ``where`` columns are
+    ANDed together, along with ``condition``, an optional (SQL text, params)
+    pair such as an ownership subquery. ``fields`` must not be empty.
+    """
+    returning_sql = sql.SQL(", ").join(sql.Identifier(column) for column in returning)
+    conditions = [sql.SQL("{} = %s").format(sql.Identifier(column)) for column in where]
+    condition_params = ()
+    if condition is not None:
+        conditions.append(sql.SQL(condition[0]))
+        condition_params = tuple(condition[1])
+    query = sql.SQL("UPDATE {} SET {} WHERE {} RETURNING {}").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(sql.SQL("{} = %s").format(sql.Identifier(column)) for column in fields),
+        sql.SQL(" AND ").join(conditions),
+        returning_sql,
+    )
+    return query, (*fields.values(), *where.values(), *condition_params)
+
+
+def partial_update(cur, table, model, where, returning, condition=None):
+    # Apply a *Update model in a single round trip; returns the row or None.
+    fields = update_fields(model)
+    if not fields:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    query, params = build_update(table, fields, where, returning, condition)
+    cur.execute(query, params)
+    return cur.fetchone()
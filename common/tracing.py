@@ -0,0 +1,195 @@
+# common/tracing.py
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from common.encoding import dumps_json
+from common.metrics import current_route
+from common.prepared import install_prepared_stats
+
+# Statements slower than SLOW_QUERY_MS are traced; 0 turns tracing off.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Share of slow statements that are logged, to bound the log volume when
+# everything is slow at once.
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1"))
+# Share of logged reads whose plan is captured with EXPLAIN (ANALYZE, BUFFERS),
+# which runs the statement a second time. Off by default; at most one plan
+# per statement every SLOW_QUERY_EXPLAIN_INTERVAL seconds.
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+# Recent slow statements kept for /stats/slow-queries.
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "100"))
+SLOW_QUERY_MAX_STATEMENTS = 500
+
+logger = logging.getLogger("slow_query")
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|\$\d+")
+_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_ROW = r"\(\s*\?(?:\s*,\s*\?)*\s*\)"
+_ROWS = re.compile(_ROW + r"(?:\s*,\s*" + _ROW + ")+")
+_WHITESPACE = re.compile(r"\s+")
+_READ_ONLY = re.compile(r"^(SELECT|WITH)\b", re.IGNORECASE)
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|nextval|setval)\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def normalize_sql(sql):
+    # Placeholders and literals become ?, so one statement groups as one key.
+    sql = _LITERALS.sub("?", sql)
+    sql = _ROWS.sub("(...), ...", sql)
+    sql = _LISTS.sub("?, ...", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _shape(value):
+    if isinstance(value, (list, tuple)):
+        return "%s[%d]" % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def param_fingerprint(params):
+    # Types and list sizes in clear, values only as a hash: repeated calls
+    # with the same arguments share a fingerprint without logging user data.
+    if not params:
+        return ""
+    values = [params[key] for key in sorted(params)] if isinstance(params, dict) else list(params)
+    digest = hashlib.blake2b(repr(values).encode("utf-8"), digest_size=6).hexdigest()
+    return "%s:%s" % (",".join(_shape(value) for value in values), digest)
+
+
+def is_read_only(sql):
+    # EXPLAIN ANALYZE executes the statement, so plans are only captured for reads.
+    return bool(_READ_ONLY.match(sql)) and not _WRITES.search(sql)
+
+
+class SlowQueryTracer:
+    """Logs statements slower than ``threshold_ms``, with a sampled plan.
+
+    The database layers (TimedCursor, AsyncDatabase) already time every
+    statement; they call ``is_slow`` and, for slow ones only, ``trace``, so a
+    fast statement costs one comparison. Each record has the normalized SQL,
+    the route being served, a parameter fingerprint and the duration, and
+    goes to the ``slow_query`` logger as one JSON line and to a ring buffer
+    served at /stats/slow-queries.
+    """
+
+    def __init__(self, threshold_ms=None, sample_rate=None, explain_rate=None, explain_interval=None, keep=None):
+        threshold_ms = SLOW_QUERY_MS if threshold_ms is None else threshold_ms
+        self.threshold = threshold_ms / 1000 if threshold_ms > 0 else float("inf")
+        self.sample_rate = SLOW_QUERY_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.explain_rate = SLOW_QUERY_EXPLAIN_RATE if explain_rate is None else explain_rate
+        self.explain_interval = SLOW_QUERY_EXPLAIN_INTERVAL if explain_interval is None else explain_interval
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=SLOW_QUERY_KEEP if keep is None else keep)
+        self._statements = {}  # normalized sql -> per-statement counters
+        self._explained_at = {}  # normalized sql -> monotonic time of the last plan
+        self._stats = {"slow": 0, "logged": 0, "explained": 0, "explain_errors": 0}
+
+    def is_slow(self, seconds):
+        return seconds >= self.threshold
+
+    def trace(self, sql, params, seconds, explain=None, error=None):
+        """Records a slow statement; returns its record when the plan should be captured.
+
+        The caller then runs EXPLAIN and hands the text to ``add_plan``, which
+        logs the record. ``explain=False`` rules capturing out, e.g. for a
+        server-side cursor.
+        """
+        statement = normalize_sql(sql)
+        with self._lock:
+            self._stats["slow"] += 1
+            counters = self._statements.get(statement)
+            if counters is None and len(self._statements) < SLOW_QUERY_MAX_STATEMENTS:
+                counters = self._statements[statement] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            if counters is not None:
+                counters["count"] += 1
+                counters["total_ms"] += seconds * 1000
+                counters["max_ms"] = max(counters["max_ms"], seconds * 1000)
+        if random.random() >= self.sample_rate:
+            return None
+        record = {
+            "sql": statement,
+            "route": current_route(),
+            "params": param_fingerprint(params),
+            "duration_ms": round(seconds * 1000, 3),
+            "at": time.time(),
+        }
+        if error is not None:
+            record["error"] = type(error).__name__
+        capture = explain is not False and error is None and self._should_explain(sql, statement)
+        if not capture:
+            self._log(record)
+        return record if capture else None
+
+    def _should_explain(self, sql, statement):
+        if self.explain_rate <= 0 or random.random() >= self.explain_rate or not is_read_only(sql.lstrip()):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained_at.get(statement)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            if len(self._explained_at) >= SLOW_QUERY_MAX_STATEMENTS:
+                self._explained_at.clear()
+            self._explained_at[statement] = now
+        return True
+
+    def add_plan(self, record, plan=None, error=None):
+        # Completes a record returned by trace() once EXPLAIN has run (or failed).
+        if error is None:
+            record["plan"] = plan
+        else:
+            record["plan_error"] = str(error).strip()
+        with self._lock:
+            self._stats["explained" if error is None else "explain_errors"] += 1
+        self._log(record)
+
+    def _log(self, record):
+        with self._lock:
+            self._stats["logged"] += 1
+            self._recent.append(record)
+        logger.warning(dumps_json(record).decode("utf-8"))
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def statements(self):
+        # Slowest statements first, by total time.
+        with self._lock:
+            items = [{"sql": sql, **counters} for sql, counters in self._statements.items()]
+        return sorted(items, key=lambda item: item["total_ms"], reverse=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold * 1000 if self.threshold != float("inf") else 0,
+                "statements": len(self._statements),
+                **self._stats,
+            }
+
+
+# One tracer per process, shared by every pool and service module.
+tracer = SlowQueryTracer()
+
+
+def install_observability(app, pool, registry):
+    """Query-level stats for a service: slow statements and prepared statements.
+
+    Adds GET /stats/slow-queries and GET /stats/prepared, and exports their
+    counters on /metrics through ``registry`` (see install_metrics).
+    """
+    registry.add_collector("slow_queries", tracer.stats)
+
+    @app.get("/stats/slow-queries")
+    def get_slow_query_stats():
+        # Statements over SLOW_QUERY_MS, by total time, and the latest records.
+        return {**tracer.stats(), "by_statement": tracer.statements(), "recent": tracer.recent()}
+
+    install_prepared_stats(app, pool, registry)
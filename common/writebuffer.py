@@ -0,0 +1,143 @@
+# common/writebuffer.py
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import psycopg2
+import psycopg2.extras
+from fastapi import HTTPException
+
+# Opt-in write-behind mode for high-volume inserts.
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER", "0").lower() in ("1", "true", "yes")
+WRITE_BUFFER_MAX_BATCH = int(os.getenv("WRITE_BUFFER_MAX_BATCH", "500"))
+WRITE_BUFFER_MAX_DELAY = float(os.getenv("WRITE_BUFFER_MAX_DELAY_MS", "5")) / 1000
+WRITE_BUFFER_MAX_QUEUE = int(os.getenv("WRITE_BUFFER_MAX_QUEUE", "10000"))
+WRITE_BUFFER_TIMEOUT = float(os.getenv("WRITE_BUFFER_TIMEOUT", "30"))
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Buffer single-row inserts and commit them in groups.
+
+    Rows queue up in a bounded in-process queue. A background thread drains it
+    every ``max_delay`` seconds, or as soon as ``max_batch`` rows are waiting,
+    and writes them with one multi-row ``INSERT ... RETURNING id`` and one
+    commit. Each caller gets its own id once its batch has committed. When the
+    queue is full new rows are refused with a 503 instead of piling up.
+
+    ``insert_sql`` is an ``execute_values`` statement (``VALUES %s``) that
+    returns the id first. ``on_flush(cur, rows, returned)`` runs in the same
+    transaction after each insert, with the rows RETURNING produced.
+    """
+
+    def __init__(self, pool, insert_sql, name, on_flush=None, max_batch=None, max_delay=None, max_queue=None):
+        self.pool = pool
+        self.insert_sql = insert_sql
+        self.name = name
+        self.on_flush = on_flush
+        self.max_batch = WRITE_BUFFER_MAX_BATCH if max_batch is None else max_batch
+        self.max_delay = WRITE_BUFFER_MAX_DELAY if max_delay is None else max_delay
+        self._queue = queue.Queue(WRITE_BUFFER_MAX_QUEUE if max_queue is None else max_queue)
+        self._thread = None
+        self._stats = {"batches": 0, "rows": 0, "rejected": 0, "failed_batches": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="group-commit-" + self.name, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        # Flushes whatever is still queued before returning.
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, values):
+        future = Future()
+        try:
+            self._queue.put_nowait((values, future))
+        except queue.Full:
+            self._stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Write buffer full", headers={"Retry-After": "1"})
+        return future
+
+    async def write(self, values):
+        future = self.submit(values)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), WRITE_BUFFER_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Write buffer timeout", headers={"Retry-After": "1"})
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+            if stop:
+                return
+
+    def _flush(self, batch):
+        rows = [values for values, _ in batch]
+        try:
+            ids = self._insert(rows)
+        except psycopg2.Error:
+            # One bad row must not fail its neighbours: retry them one by one.
+            self._stats["failed_batches"] += 1
+            for values, future in batch:
+                try:
+                    future.set_result(self._insert([values])[0])
+                except Exception as e:
+                    future.set_exception(_as_http_error(e))
+            return
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(_as_http_error(e))
+            return
+        for (_, future), row_id in zip(batch, ids):
+            future.set_result(row_id)
+
+    def _insert(self, rows):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            returned = psycopg2.extras.execute_values(cur, self.insert_sql, rows, page_size=len(rows), fetch=True)
+            ids = [row[0] for row in returned]
+            if self.on_flush is not None:
+                self.on_flush(cur, rows, returned)
+            conn.commit()
+        self._stats["batches"] += 1
+        self._stats["rows"] += len(rows)
+        return ids
+
+    def stats(self):
+        batches = self._stats["batches"]
+        return {
+            "queued": self._queue.qsize(),
+            "avg_batch_rows": round(self._stats["rows"] / batches, 2) if batches else 0,
+            **self._stats,
+        }
+
+
+def _as_http_error(exc):
+    if isinstance(exc, HTTPException):
+        return exc
+    if isinstance(exc, (psycopg2.DataError, psycopg2.IntegrityError)):
+        return HTTPException(status_code=422, detail="Row rejected: %s" % exc.pgerror)
+    return HTTPException(status_code=500, detail="Database write error")
@@ -0,0 +1,153 @@
+# gateway/main.py
+import asyncio
+import os
+import time
+import httpx
+from fastapi import FastAPI, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from common.cache import MISSING, TTLCache
+from common.metrics import TimedJSONResponse, install_metrics
+from common.singleflight import SingleFlight
+
+app = FastAPI(title="API Gateway", default_response_class=TimedJSONResponse)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+# Bodies of at least GZIP_MIN_SIZE bytes are gzipped for clients that accept it.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+# Backends, by their compose service names.
+BACKENDS = {
+    "users": os.getenv("USERS_API_URL", "http://api_users:8080"),
+    "transactions": os.getenv("TRANSACTIONS_API_URL", "http://api_transactions:8080"),
+    "metas": os.getenv("METAS_API_URL", "http://api_metas:8080"),
+}
+# Deadline for each backend call; a section that misses it is left out.
+GATEWAY_TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT_MS", "500")) / 1000
+GATEWAY_MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", "100"))
+GATEWAY_MAX_KEEPALIVE = int(os.getenv("GATEWAY_MAX_KEEPALIVE", "20"))
+# Sections are cached briefly: home screens are re-fetched on every app resume.
+GATEWAY_CACHE_TTL = float(os.getenv("GATEWAY_CACHE_TTL", "2"))
+GATEWAY_CACHE_MAXSIZE = int(os.getenv("GATEWAY_CACHE_MAXSIZE", "10000"))
+HOME_TRANSACTIONS = int(os.getenv("GATEWAY_HOME_TRANSACTIONS", "10"))
+
+# One pooled keep-alive client per process, shared by every request.
+client = None
+
+@app.on_event("startup")
+async def open_client():
+    global client
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=GATEWAY_MAX_CONNECTIONS, max_keepalive_connections=GATEWAY_MAX_KEEPALIVE),
+        timeout=GATEWAY_TIMEOUT,
+    )
+
+@app.on_event("shutdown")
+async def close_client():
+    await client.aclose()
+
+section_cache = TTLCache("gateway_section", maxsize=GATEWAY_CACHE_MAXSIZE, ttl=GATEWAY_CACHE_TTL)
+flight = SingleFlight()
+backend_stats = {name: {"calls": 0, "timeouts": 0, "errors": 0} for name in BACKENDS}
+
+metrics = install_metrics(app)
+metrics.add_collector("gateway_cache", section_cache.stats)
+metrics.add_collector("coalescing", flight.stats)
+for _name in BACKENDS:
+    metrics.add_collector("gateway_backend_" + _name, backend_stats[_name].copy)
+
+@app.get("/stats/backends")
+def get_backend_stats():
+    return {"backends": backend_stats, "cache": section_cache.stats(), "coalescing": flight.stats()}
+
+class BackendError(Exception):
+    def __init__(self, reason, status_code=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+async def call_backend(backend, path, params=None, timeout=None):
+    # One GET with a hard deadline covering connect, pool wait and body.
+    stats = backend_stats[backend]
+    stats["calls"] += 1
+    try:
+        response = await asyncio.wait_for(
+            client.get(BACKENDS[backend] + path, params=params), GATEWAY_TIMEOUT if timeout is None else timeout
+        )
+    except asyncio.TimeoutError:
+        stats["timeouts"] += 1
+        raise BackendError("timeout")
+    except httpx.HTTPError:
+        stats["errors"] += 1
+        raise BackendError("unavailable")
+    if response.status_code != 200:
+        if response.status_code >= 500 or response.status_code == 429:
+            stats["errors"] += 1
+        raise BackendError("status %d" % response.status_code, response.status_code)
+    return response.json()
+
+async def fetch_section(name, backend, path, params=None):
+    key = (name, path, tuple(sorted((params or {}).items())))
+    cached = section_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    data = await call_backend(backend, path, params)
+    section_cache.set(key, data)
+    return data
+
+async def aggregate(sections):
+    """Fetches every section concurrently; latency is that of the slowest call.
+
+    ``sections`` maps a name to (backend, path, params, required). A failed
+    optional section is reported under "errors" and the rest is returned; a
+    failed required section fails the request with the backend's status.
+    """
+    names = list(sections)
+    results = await asyncio.gather(
+        *(fetch_section(name, *sections[name][:3]) for name in names), return_exceptions=True
+    )
+    body, errors = {}, {}
+    for name, result in zip(names, results):
+        if isinstance(result, BackendError):
+            if sections[name][3]:
+                if result.status_code == 404:
+                    raise HTTPException(status_code=404, detail="Not found")
+                raise HTTPException(status_code=502, detail="%s: %s" % (name, result.reason))
+            body[name] = None
+            errors[name] = result.reason
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            body[name] = result
+    body["partial"] = bool(errors)
+    body["errors"] = errors
+    return body
+
+# ---------- Composite endpoints ----------
+
+def home_sections(user_id):
+    return {
+        "profile": ("users", "/users/%d/profile" % user_id, None, True),
+        "wallet": ("users", "/users/%d/wallet" % user_id, None, False),
+        "transactions": ("transactions", "/users/%d/transactions" % user_id, {"limit": HOME_TRANSACTIONS}, False),
+        "summary": ("transactions", "/users/%d/transactions/summary" % user_id, None, False),
+        "campaigns": ("metas", "/users/%d/campaigns/progress" % user_id, None, False),
+    }
+
+@app.get("/users/{user_id}/home")
+async def get_user_home(user_id: int):
+    # Everything the app's home screen shows, in one round trip. Concurrent
+    # requests for a user share the fan-out; each builds its own response,
+    # which GZipMiddleware then rewrites.
+    start = time.perf_counter()
+    body = await flight.do_async(("home", user_id), aggregate, home_sections(user_id))
+    return TimedJSONResponse(
+        {"user_id": user_id, **body},
+        headers={"Server-Timing": "fanout;dur=%.1f" % ((time.perf_counter() - start) * 1000)},
+    )
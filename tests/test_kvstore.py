@@ -0,0 +1,93 @@
+# tests/test_kvstore.py
+import multiprocessing
+import os
+
+from common.kvstore import HEADER, LogStore
+
+
+def open_store(path, **kwargs):
+    store = LogStore(str(path), **kwargs)
+    store.open()
+    return store
+
+
+def test_torn_tail_is_cut_off(tmp_path):
+    path = tmp_path / "kv.log"
+    store = open_store(path)
+    store.put("a", [1])
+    store.put("b", [2])
+    size = os.path.getsize(path)
+    store.close()
+    # A crash in the middle of a third append.
+    with open(path, "ab") as f:
+        f.write(HEADER.pack(0, 0, 1, 100) + b"c" + b"\0" * 10)
+
+    store = open_store(path)
+    assert store.get("a") == [1]
+    assert store.get("b") == [2]
+    assert store.get("c") is None
+    assert os.path.getsize(path) == size
+    assert store.stats()["truncated_bytes"] == HEADER.size + 11
+    store.put("c", [3])
+    store.close()
+    assert open_store(path).get("c") == [3]
+
+
+def test_corrupt_record_inside_the_file_is_skipped(tmp_path):
+    path = tmp_path / "kv.log"
+    store = open_store(path)
+    store.put("a", [1])
+    store.put("b", [1])
+    offset = os.path.getsize(path)
+    store.put("b", [2])
+    store.put("c", [3])
+    size = os.path.getsize(path)
+    store.close()
+    with open(path, "r+b") as f:
+        f.seek(offset + HEADER.size + 2)
+        f.write(b"\xff")
+
+    store = open_store(path)
+    assert store.get("a") == [1]
+    assert store.get("b") == [1]
+    assert store.get("c") == [3]
+    assert os.path.getsize(path) == size
+    assert store.stats()["corrupt_bytes"] > 0
+    assert store.stats()["truncated_bytes"] == 0
+
+
+def test_compaction_keeps_the_latest_values(tmp_path):
+    path = tmp_path / "kv.log"
+    store = open_store(path, compact_ratio=0.5, compact_min_bytes=0)
+    other = open_store(path)
+    for i in range(100):
+        store.put("counter", i)
+        store.put("key-%d" % (i % 5), [i])
+    assert store.stats()["compactions"] > 0
+    # Dead records never pass half of the file.
+    assert os.path.getsize(path) <= 2 * store.stats()["live_bytes"]
+    # Another process picks up the replaced file on its next call.
+    assert other.get("counter") == 99
+    assert [other.get("key-%d" % i) for i in range(5)] == [[95], [96], [97], [98], [99]]
+    other.put("counter", 100)
+    assert store.get("counter") == 100
+
+
+def _increment(path, times):
+    store = open_store(path)
+    for _ in range(times):
+        store.update("counter", lambda value: value + 1, default=0)
+    store.close()
+
+
+def test_updates_from_several_processes_are_not_lost(tmp_path):
+    path = str(tmp_path / "kv.log")
+    open_store(path).close()
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_increment, args=(path, 200)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    assert open_store(path, fsync=False).get("counter") == 800